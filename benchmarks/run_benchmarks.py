@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+""" Measures hot paths of the game in scripted scenarios
+
+Usage: python benchmarks/run_benchmarks.py [--ticks N] [--scenario NAME]
+                                           [--output FILE] [--window]
+
+Reports (as JSON) startup time of Resources.load_all and per tick cost
+of PacmanGame.update, PacmanGame.display, Ghost.update and of showing
+the frame (GameFsm.present - scaling and flip). Without --window SDL
+dummy video driver is used, so the numbers don't include the cost of
+the real display.
+"""
+
+import os, sys, json, time
+base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base_path)
+if not "--window" in sys.argv:
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+
+import pygame
+
+from src.config import Config, argument_value
+from src.game_fsm import GameFsm
+from src.resources import Resources
+from src.main import PacmanGame, Ghost
+from benchmarks.scenarios import all_scenarios, scripted_inputs
+
+class Stopwatch:
+    """ Collects durations of measured calls
+    """
+    def __init__(self):
+        self.samples = []
+        self.calls = 0
+
+    def measure(self, f, *args):
+        start = time.time()
+        result = f(*args)
+        self.samples.append(time.time() - start)
+        return result
+
+    def wrap_method(self, cls, name):
+        """ Measure every call of cls.name until unwrap is called
+        """
+        self.cls, self.name = cls, name
+        self.original = cls.__dict__[name]
+        original = self.original
+        stopwatch = self
+        def measured(self_, *args):
+            start = time.time()
+            result = original(self_, *args)
+            stopwatch.samples.append(time.time() - start)
+            return result
+        setattr(cls, name, measured)
+
+    def unwrap(self):
+        setattr(self.cls, self.name, self.original)
+
+    def report(self):
+        """ Mean, median, 95th percentile and max in microseconds
+        """
+        if not self.samples:
+            return {"count" : 0}
+        samples = sorted(self.samples)
+        n = len(samples)
+        return {"count"  : n,
+                "mean_us": sum(samples) / n * 1e6,
+                "p50_us" : samples[n / 2] * 1e6,
+                "p95_us" : samples[min(n - 1, n * 95 / 100)] * 1e6,
+                "max_us" : samples[-1] * 1e6}
+
+def benchmark_startup(cfg, repeat = 3):
+    stopwatch = Stopwatch()
+    for i in range(repeat):
+        stopwatch.measure(Resources(cfg).load_all)
+    return stopwatch.report()
+
+def benchmark_scenario(cfg, res, fsm, scenario, ticks):
+    game = PacmanGame(cfg, res)
+    game.init(fsm.screen)
+    before_tick = scenario(game)
+    dt = 1.0 / cfg.fps_limit
+
+    update, display, present, ghost_update = Stopwatch(), Stopwatch(), Stopwatch(), Stopwatch()
+    ghost_update.wrap_method(Ghost, "update")
+    try:
+        for tick in range(ticks):
+            before_tick(tick)
+            for pacman, direction in zip(game.pacman, scripted_inputs(tick, len(game.pacman))):
+                pacman.next_direction = direction
+            game.start_game()
+            update.measure(game.update, dt)
+            display.measure(game.display, fsm.screen)
+            present.measure(fsm.present)
+    finally:
+        ghost_update.unwrap()
+        game.finish()
+
+    return {"update"       : update.report(),
+            "display"      : display.report(),
+            "present"      : present.report(),
+            "ghost_update" : ghost_update.report()}
+
+def main():
+    ticks = int(argument_value("--ticks", 600))
+    only = argument_value("--scenario")
+    output = argument_value("--output")
+
+    cfg = Config(base_path)
+    cfg.sound = False
+    cfg.music = False
+    fsm = GameFsm(cfg)
+    results = {"python"    : sys.version.split()[0],
+               "pygame"    : pygame.version.ver,
+               "ticks"     : ticks,
+               "startup"   : benchmark_startup(cfg),
+               "scenarios" : {}}
+
+    res = Resources(cfg)
+    res.load_all()
+    for name, scenario in all_scenarios:
+        if only and name != only:
+            continue
+        results["scenarios"][name] = benchmark_scenario(cfg, res, fsm, scenario, ticks)
+
+    text = json.dumps(results, indent = 2, sort_keys = True)
+    if output:
+        open(output, "w").write(text + "\n")
+    else:
+        print text
+
+if __name__ == "__main__":
+    main()
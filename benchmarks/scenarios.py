@@ -0,0 +1,63 @@
+""" Scripted game situations measured by run_benchmarks.py
+
+A scenario is a function that prepares fresh PacmanGame and returns
+function called before every tick (it may keep the situation going,
+i.e. frighten ghosts again when frightened mode finishes).
+"""
+
+from src.const import *
+
+def scripted_inputs(tick, players):
+    """ Deterministic input: every pacman changes direction each second
+    """
+    directions = [DIR_LEFT, DIR_UP, DIR_RIGHT, DIR_DOWN]
+    k = tick / 60
+    return [directions[(k + i) % 4] for i in range(players)]
+
+def immortal(game):
+    for pacman in game.pacman:
+        pacman.lives = 99
+
+def full_maze(game):
+    immortal(game)
+    return lambda tick: None
+
+def empty_maze(game):
+    immortal(game)
+    w, h = game.maze.size()
+    for cy in range(h):
+        for cx in range(w):
+            eaten = game.maze.eat((cx, cy))
+            if eaten:
+                game.dot_layer.eat((cx, cy), eaten)
+    return lambda tick: None
+
+def frightened(game):
+    immortal(game)
+    def keep_frightened(tick):
+        if not game.frighten_mode:
+            game.frighten_ghosts()
+    return keep_frightened
+
+def two_players(game):
+    game.add_green_pacman()
+    immortal(game)
+    return lambda tick: None
+
+def dead_ghosts(game):
+    """ Every ghost that leaves the prison is killed and returns home
+    """
+    immortal(game)
+    def kill_ghosts(tick):
+        for ghost in game.ghost:
+            if ghost.state in (GHOST_STATE_CHASE, GHOST_STATE_SCATTER):
+                ghost.isdead = True
+    return kill_ghosts
+
+all_scenarios = [
+    ("full_maze",   full_maze),
+    ("empty_maze",  empty_maze),
+    ("frightened",  frightened),
+    ("two_players", two_players),
+    ("dead_ghosts", dead_ghosts),
+    ]
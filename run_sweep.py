@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+
+from src import sweep
+
+if __name__ == "__main__":
+    sweep.main()
@@ -0,0 +1,72 @@
+""" Sprite atlas and batched drawing
+
+The Atlas packs frames of all animations into one Surface. Sprites refer
+to their frames by a rect of the atlas, so every frame is drawn from the
+same source surface.
+
+RenderQueue collects blits (it has the blit method of a Surface, so it
+can be passed to display methods instead of the screen) and submits
+them in one Surface.blits call.
+"""
+
+import pygame
+from pygame.locals import *
+
+class Atlas:
+    width = 256 # frames are packed into rows (shelves) of this width
+    padding = 1 # transparent pixels between frames
+
+    def __init__(self, animation, skip = ()):
+        """ Packs frames of animation (dictionary name -> list of
+        Surfaces) except the animations in skip. The frames in
+        animation are replaced by subsurfaces of the atlas
+        """
+        frames = []
+        for name, animation_frames in animation.items():
+            if name in skip:
+                continue
+            for index, frame in enumerate(animation_frames):
+                frames.append((name, index, frame))
+        # tall frames first - rows are filled with frames of similar height
+        frames.sort(key = lambda f: (-f[2].get_height(), f[0], f[1]))
+
+        width = max([self.width] + [frame.get_width() + self.padding for name, index, frame in frames])
+        positions = []
+        x, y, row_height = 0, 0, 0
+        for name, index, frame in frames:
+            w, h = frame.get_size()
+            if x + w > width:
+                x, y, row_height = 0, y + row_height + self.padding, 0
+            positions.append((x, y))
+            x += w + self.padding
+            row_height = max(row_height, h)
+
+        self.surface = pygame.Surface((width, max(1, y + row_height))).convert_alpha()
+        self.surface.fill((0,0,0,0))
+        self.rects = {}
+        for (name, index, frame), position in zip(frames, positions):
+            # max with transparent black copies the pixels with their alpha
+            self.surface.blit(frame, position, None, BLEND_RGBA_MAX)
+            rect = pygame.Rect(position, frame.get_size())
+            self.rects.setdefault(name, [None] * len(animation[name]))[index] = rect
+        for name, rects in self.rects.items():
+            animation[name] = [self.surface.subsurface(rect) for rect in rects]
+
+class RenderQueue:
+    """ Blits collected during a frame
+    """
+    def __init__(self):
+        self.items = []
+
+    def blit(self, source, dest, area = None, special_flags = 0):
+        self.items.append((source, dest, area, special_flags))
+
+    def flush(self, screen):
+        """ Draw collected blits onto the screen in order
+        """
+        if hasattr(screen, "blits"): # pygame >= 1.9.4
+            screen.blits(self.items, 0)
+        else:
+            for item in self.items:
+                screen.blit(*item)
+        self.items = []
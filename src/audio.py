@@ -0,0 +1,191 @@
+""" Audio engine - channel pools, looped sounds and decoded PCM cache
+
+Every sound belongs to a category and every category has its own pool
+of mixer channels (Config.audio_channels). The pools are reserved, so a
+burst of effects can't take the channel of the siren and pygame never
+picks a channel on its own. When all channels of a pool play, the one
+that started first is taken over and the play is counted as dropped.
+
+Looped sounds (i.e. waka while pacman eats dots) don't need updates
+every frame. Every loop channel has its own event type: start_loop arms
+an SDL timer that posts the event after the cooldown and every next
+start_loop restarts it. The event (see process_event) stops the loop.
+
+Decoding ogg files takes milliseconds per sound, so the decoded PCM
+samples are stored in a cache file and later loaded from there:
+
+    magic, uint32 length of the header, header (JSON with the mixer
+    format, size and modification time of the sources and (offset,
+    length) of every sound), samples
+
+The cache is rebuilt when the mixer format or any source changes.
+"""
+
+import os, json, struct, time
+import pygame
+from pygame.locals import *
+
+PCM_MAGIC = "P4TA\x01"
+
+LOOP_EVENTS = range(USEREVENT, NUMEVENTS) # one event type per loop channel
+
+class AudioEngine:
+    """ Plays sounds on channel pools and counts what happens to them
+    """
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.pools = {} # category -> list of Channels
+        self.started = {} # Channel -> time its sound started
+        self.loops = {} # name -> Channel of the looped sound
+        self.loop_events = {} # Channel of "loop" pool -> its event type
+        self.plays = {} # category -> count of plays
+        self.dropped = {} # category -> plays that took over a busy channel or got none
+        self.play_time = 0 # spent in play calls
+        self.play_max = 0
+
+    def open(self):
+        """ Reserve channels of the pools. The mixer has to be
+        initialized
+        """
+        total = sum(self.cfg.audio_channels.values())
+        pygame.mixer.set_num_channels(total)
+        pygame.mixer.set_reserved(total)
+        first = 0
+        for category, count in sorted(self.cfg.audio_channels.items()):
+            self.pools[category] = [pygame.mixer.Channel(i) for i in range(first, first + count)]
+            self.__count_drop(category, False)
+            first += count
+        loop_channels = self.pools.get("loop", [])
+        if len(loop_channels) > len(LOOP_EVENTS):
+            raise ValueError("at most %d loop channels are supported" % len(LOOP_EVENTS))
+        self.loop_events = dict(zip(loop_channels, LOOP_EVENTS))
+
+    def latency(self):
+        """ Seconds a sound waits in the output buffer before it is heard
+        """
+        return float(self.cfg.audio_buffer) / self.cfg.audio_rate
+
+    def play(self, sound, category, loops = 0):
+        """ Play the sound on a channel of the category. Returns the
+        Channel or None if the category has no channel for it
+        """
+        pool = [channel for channel in self.pools.get(category, [])
+                if channel not in self.loops.values()]
+        channel = self.__free_channel(pool)
+        if channel is None and pool:
+            channel = min(pool, key = lambda c: self.started[c]) # the oldest sound is cut
+        self.__count_drop(category, channel is None or channel.get_busy())
+        if channel is not None:
+            self.__play_on(channel, sound, category, loops)
+        return channel
+
+    def __free_channel(self, pool):
+        for channel in pool:
+            if not channel.get_busy() and channel not in self.loops.values():
+                return channel
+        return None
+
+    def __count_drop(self, category, dropped):
+        self.plays.setdefault(category, 0)
+        self.dropped.setdefault(category, 0)
+        if dropped:
+            self.dropped[category] += 1
+
+    def __play_on(self, channel, sound, category, loops):
+        start = time.time()
+        channel.play(sound, loops)
+        self.started[channel] = start
+        self.plays[category] += 1
+        elapsed = time.time() - start
+        self.play_time += elapsed
+        self.play_max = max(self.play_max, elapsed)
+
+    def start_loop(self, name, sound, cooldown = None):
+        """ Play the sound in a loop on a "loop" channel unless it plays
+        already. If cooldown (seconds) is set the loop stops when
+        start_loop is not called again in that time, otherwise
+        stop_loop stops it
+        """
+        channel = self.loops.get(name)
+        if channel is None:
+            channel = self.__free_channel(self.pools.get("loop", []))
+            self.__count_drop("loop", channel is None)
+            if channel is None:
+                return
+            self.__play_on(channel, sound, "loop", -1)
+            self.loops[name] = channel
+        if cooldown is not None:
+            pygame.time.set_timer(self.loop_events[channel], int(cooldown * 1000))
+
+    def stop_loop(self, name):
+        channel = self.loops.pop(name, None)
+        if channel is None:
+            return
+        pygame.time.set_timer(self.loop_events[channel], 0)
+        channel.stop()
+
+    def process_event(self, event):
+        """ Handle an event of LOOP_EVENTS - cooldown of the loop is over
+        """
+        for name, channel in self.loops.items():
+            if self.loop_events[channel] == event.type:
+                self.stop_loop(name)
+
+    def report(self):
+        plays = sum(self.plays.values())
+        print "audio: %d Hz, buffer %d samples, latency %.1f ms, play %.3f ms mean, %.3f ms max" % (
+            self.cfg.audio_rate, self.cfg.audio_buffer, self.latency() * 1000,
+            plays and self.play_time * 1000 / plays, self.play_max * 1000)
+        for category in sorted(self.plays):
+            print "audio: %-8s %d channels, %d plays, %d dropped" % (
+                category, len(self.pools.get(category, [])), self.plays[category],
+                self.dropped[category])
+
+def write_pcm_cache(path, sounds, stamps):
+    """ Store samples of sounds (dictionary name -> Sound) in the cache
+    file
+    """
+    header = {"format" : pygame.mixer.get_init(), "sources" : stamps, "sounds" : {}}
+    chunks = []
+    offset = 0
+    for name, sound in sorted(sounds.items()):
+        data = sound.get_raw()
+        header["sounds"][name] = [offset, len(data)]
+        chunks.append(data)
+        offset += len(data)
+    header = json.dumps(header)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = path + ".tmp"
+    f = open(tmp_path, "wb")
+    f.write(PCM_MAGIC)
+    f.write(struct.pack("<I", len(header)))
+    f.write(header)
+    for chunk in chunks:
+        f.write(chunk)
+    f.close()
+    os.rename(tmp_path, path) # readers never see half written cache
+
+def read_pcm_cache(path, stamps):
+    """ Dictionary name -> Sound from the cache file or None if it
+    doesn't exist, is broken or out of date
+    """
+    try:
+        data = open(path, "rb").read()
+    except IOError:
+        return None
+    if not data.startswith(PCM_MAGIC):
+        return None
+    try:
+        pos = len(PCM_MAGIC)
+        size, = struct.unpack_from("<I", data, pos)
+        pos += 4
+        header = json.loads(data[pos:pos + size])
+        pos += size
+        if header["sources"] != stamps or tuple(header["format"]) != pygame.mixer.get_init():
+            return None
+        return dict((str(name), pygame.mixer.Sound(buffer = data[pos + offset:pos + offset + length]))
+                    for name, (offset, length) in header["sounds"].items())
+    except (ValueError, KeyError, struct.error):
+        return None
@@ -0,0 +1,229 @@
+""" Controllers - what drives pacmans besides the keyboard
+
+A controller is attached to Pacman.controller. PacmanGame.control asks
+it before every tick where the pacman should go, like a player pressing
+keys. Decisions are recorded by replay.Recorder as any other input, so
+a game played by controllers can be replayed without them.
+
+AutopilotController plays by itself (--autopilot, run_sweep.py --policy
+autopilot). It searches the maze breadth first from its cell, entering
+only cells it reaches before any ghost could (pacman is faster than
+ghosts, see Config), and goes to the first dot found. When no dot can
+be reached safely it heads for the visited cell farthest ahead of the
+ghosts. The target is kept until it is reached or gets unsafe and
+energizers are saved for when pacman is cornered. The search stops
+"reach" cells away - dots farther are found in the table of pacman's
+cell. Distances of ghosts are the minimum of the tables of their cells
+kept by DistanceTables for all controllers and ghosts - after a few
+laps of the maze a decision is one small search with table lookups.
+"""
+
+from collections import deque
+
+from distance import UNREACHABLE
+from const import *
+from utils import *
+
+class Controller:
+    """ Base of controllers
+    """
+    def decide(self, game, pacman):
+        """ New direction (DIR_*) of the pacman or None to keep going
+        """
+        return None
+
+class AutopilotController(Controller):
+    """ Bot eating dots and avoiding ghosts
+
+    level  Level of the game (the maze doesn't have to have dots)
+    tables DistanceTables of the level
+    """
+    danger = 8 # decisions are made every tick when a ghost is this close (cells)
+    margin = 1 # cells a ghost has to be behind pacman's arrival to a cell
+    room = 12 # safe cells behind a step that is not a trap
+    reach = 26 # steps of the search
+    patience = 600 # ticks without a dot eaten until pacman takes the most risk
+    caution = 0.3 # part of margin and room left then
+
+    def __init__(self, level, tables, cfg):
+        self.tables = tables
+        self.grid_cell_size = cfg.grid_cell_size
+        # cells a ghost passes while pacman passes one
+        self.ghost_pace = float(cfg.ghost_speed) / cfg.packman_standard_speed
+        self.width, self.height = level.maze.size()
+        # cells of dots and energizers, eaten ones are skipped
+        self.food_cells = [cy * self.width + cx
+                           for cx, cy in level.dots + level.energizers]
+        self.cell = None # where the last decision was made
+        self.target = None # cell index pacman goes to
+        self.position = None
+        self.decisions = 0
+        self.dots_eaten = None
+        self.hungry = 0 # ticks since a dot was eaten
+
+    def decide(self, game, pacman):
+        if game.dots_eaten != self.dots_eaten:
+            self.dots_eaten = game.dots_eaten
+            self.hungry = 0
+        self.hungry += 1
+        cx, cy = position_to_cell(self.grid_cell_size, pacman.position)
+        if not (0 <= cx < self.width and 0 <= cy < self.height):
+            return None # in the tunnel
+        cell = cy * self.width + cx
+        ghosts = self.__ghosts(game)
+        # decide when entering a cell, when stuck or when a ghost is near
+        distances = self.tables.distances(cell)
+        nearest = min([distances[i] for ghost, i in ghosts] or [UNREACHABLE])
+        if ((cx, cy) == self.cell and pacman.position != self.position and
+            nearest > self.danger):
+            self.position = pacman.position
+            return None
+        self.cell = cx, cy
+        self.position = pacman.position
+        self.decisions += 1
+        starts = self.__ghost_starts(ghosts, distances)
+        return self.__plan(game.maze.cells, cell, starts, pacman.direction)
+
+    def __plan(self, cells, start, ghosts, heading):
+        """ First step to the target. The target is the closest dot
+        pacman reaches before the ghosts with room to run behind it,
+        an energizer when pacman is cornered, the closest dot beyond the
+        search or the cell farthest ahead of the ghosts. It is kept until
+        it is reached or not safe
+        """
+        # pacman takes more risk when he can't get to the dots
+        courage = max(1 - float(self.hungry) / self.patience, self.caution)
+        least, enough = self.margin * courage, self.room * courage
+        neighbors = self.tables.neighbors
+        first = {start : None} # cell -> direction of the first step to it
+        depth = {start : 0} # cell -> steps to it
+        room = {} # direction of the first step -> count of safe cells behind it
+        dots = {} # direction of the first step -> the closest dot behind it
+        energizers = {} # the same for energizers
+        # direction of the first step -> (most steps ghosts are behind, cell)
+        escapes = {}
+        queue = deque([start])
+        while queue:
+            i = queue.popleft()
+            d = depth[i] + 1
+            if d > self.reach:
+                break
+            for direction, j in neighbors[i]:
+                if j in first:
+                    continue
+                ghost = min([table[j] + steps for table, steps in ghosts])
+                margin = ghost - d * self.ghost_pace
+                if margin < least:
+                    continue # a ghost could be there first
+                step = first[j] = direction if i == start else first[i]
+                depth[j] = d
+                room[step] = room.get(step, 0) + 1
+                if margin >= escapes.get(step, (-1, None))[0]:
+                    escapes[step] = margin, j
+                if cells[j] & CELL_DOT:
+                    dots.setdefault(step, j)
+                elif cells[j] & CELL_ENERGIZER:
+                    energizers.setdefault(step, j)
+                queue.append(j)
+        if not room:
+            self.target = None
+            return self.__flee(start, ghosts)
+        # room to run from the ghosts - little is enough with the ghosts
+        # far, turning back is worth it only for clearly more
+        space = {}
+        for step in room:
+            space[step] = min(max(room[step], escapes[step][0] - self.room), enough)
+            if heading != DIR_STOP and step == (heading + 2) % 4:
+                space[step] -= self.room / 2
+        best = max(space.values())
+        roomy = [step for step in room if space[step] == best]
+        food = [dots[step] for step in roomy if step in dots]
+        if not food:
+            food = [energizers[step] for step in roomy if step in energizers]
+        target = self.target
+        if target not in first or target == start or space[first[target]] < best:
+            target = None # reached, out of the search or not safe
+        elif food and not cells[target] & (CELL_DOT | CELL_ENERGIZER):
+            target = None # there is food to go for now
+        if target is None:
+            if best < enough and energizers:
+                # cornered - energizers are saved for this
+                target = min(energizers.values(), key = depth.get)
+            elif food:
+                target = min(food, key = depth.get)
+            else:
+                far = self.__far_food(cells, start)
+                if far is not None:
+                    self.target = far
+                    return self.__step_to(far, start, roomy)
+                target = max([escapes[step] for step in roomy])[1]
+        self.target = target
+        return first[target]
+
+    def __far_food(self, cells, start):
+        """ Closest dot or energizer left - beyond the search. None when
+        everything is eaten
+        """
+        left = [i for i in self.food_cells if cells[i] & (CELL_DOT | CELL_ENERGIZER)]
+        if not left:
+            return None
+        distances = self.tables.distances(start)
+        return min(left, key = distances.__getitem__)
+
+    def __step_to(self, target, start, steps):
+        """ Step of steps (directions from start) closest to the target
+        """
+        distances = self.tables.distances(target)
+        options = [(distances[j], direction)
+                   for direction, j in self.tables.neighbors[start]
+                   if direction in steps]
+        return min(options)[1]
+
+    def __flee(self, start, ghosts):
+        """ Step to the neighbor farthest from the ghosts - nothing is
+        safe
+        """
+        best, best_distance = None, -1
+        for direction, j in self.tables.neighbors[start]:
+            distance = min([table[j] + steps for table, steps in ghosts])
+            if distance > best_distance:
+                best, best_distance = direction, distance
+        return best
+
+    def __ghosts(self, game):
+        """ (ghost, cell index) of ghosts that can kill the pacman
+        """
+        ghosts = []
+        for ghost in game.ghost:
+            if ghost.isdead or (ghost.frightened and game.frightened_timer > 1):
+                continue
+            cell = position_to_cell(self.grid_cell_size, ghost.position)
+            ghosts.append((ghost, self.tables.target_index(cell)))
+        return ghosts
+
+    def __ghost_starts(self, ghosts, distances):
+        """ (table of distances, steps made already) of cells the ghosts
+        go from. The tables are kept by DistanceTables - the distance of
+        the closest ghost to a cell is the minimum of table[cell] + steps.
+        distances is the table of pacman's cell
+        """
+        # farther ghosts can't get to any cell of the search first
+        far = self.reach * (1 + self.ghost_pace) + self.margin
+        starts = {} # cell index -> steps
+        for ghost, cell in ghosts:
+            if distances[cell] >= far:
+                continue
+            ahead = []
+            if ghost.state in (GHOST_STATE_CHASE, GHOST_STATE_SCATTER):
+                # a ghost in the maze can't turn back, so he goes through
+                # one of the other neighbors of his cell
+                back = (ghost.direction + 2) % 4
+                ahead = [j for direction, j in self.tables.neighbors[cell]
+                         if direction != back]
+            for j in ahead:
+                starts.setdefault(j, 1)
+            if not ahead:
+                starts[cell] = 0
+        if not starts:
+            return [(self.tables.distances(None), 0)] # no ghost to avoid
+        return [(self.tables.distances(i), steps) for i, steps in starts.items()]
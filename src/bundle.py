@@ -0,0 +1,104 @@
+""" Packed animation frames
+
+Loading the game means decoding all PNGs and deriving colored, rotated
+and flipped animations from them. The result is the same every time,
+so it is stored in one file - the bundle - and later mapped to memory
+instead of being built again.
+
+The bundle is a header followed by raw RGBA pixels of all frames:
+
+    magic, uint32 length of the index, index (JSON), pixels
+
+The index stores for every animation a list of (offset, width, height)
+of its frames and size and modification time of every source image.
+The bundle is rebuilt when any of the source images changes.
+"""
+
+import os, json, mmap, struct
+import pygame
+
+BUNDLE_MAGIC = "P4TB\x01"
+
+def source_stamps(directory, extension = ".png"):
+    """ Size and modification time of every file with the extension
+    (images by default) in the directory
+    """
+    stamps = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(extension):
+            stat = os.stat(os.path.join(directory, name))
+            stamps[name] = [stat.st_mtime, stat.st_size]
+    return stamps
+
+def write_bundle(path, animation, stamps):
+    """ Store all frames of animations (dictionary name -> list of
+    Surfaces) in the bundle file
+    """
+    index = {"sources" : stamps, "animation" : {}}
+    chunks = []
+    offset = 0
+    for name, frames in animation.items():
+        entries = []
+        for frame in frames:
+            data = pygame.image.tostring(frame, "RGBA")
+            w, h = frame.get_size()
+            entries.append([offset, w, h])
+            chunks.append(data)
+            offset += len(data)
+        index["animation"][name] = entries
+    header = json.dumps(index)
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = path + ".tmp"
+    f = open(tmp_path, "wb")
+    f.write(BUNDLE_MAGIC)
+    f.write(struct.pack("<I", len(header)))
+    f.write(header)
+    for chunk in chunks:
+        f.write(chunk)
+    f.close()
+    os.rename(tmp_path, path) # readers never see half written bundle
+
+class Bundle:
+    """ Bundle file mapped to memory
+    """
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        if self.data[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+            self.close()
+            raise ValueError("%s is not an asset bundle" % path)
+        pos = len(BUNDLE_MAGIC)
+        header_size, = struct.unpack_from("<I", self.data, pos)
+        pos += 4
+        self.index = json.loads(self.data[pos:pos + header_size])
+        self.pixels_offset = pos + header_size
+
+    def is_fresh(self, stamps):
+        return self.index["sources"] == stamps
+
+    def animations(self):
+        """ Returns dictionary name -> list of Surfaces
+
+        Surfaces are created directly from the mapped memory. If the
+        display is set they are converted to its format (it makes
+        blitting faster)
+        """
+        convert = pygame.display.get_surface() is not None
+        animation = {}
+        for name, entries in self.index["animation"].items():
+            frames = []
+            for offset, w, h in entries:
+                pixels = buffer(self.data, self.pixels_offset + offset, w * h * 4)
+                frame = pygame.image.frombuffer(pixels, (w, h), "RGBA")
+                if convert:
+                    frame = frame.convert_alpha()
+                frames.append(frame)
+            animation[str(name)] = frames
+        return animation
+
+    def close(self):
+        self.data.close()
+        self.file.close()
@@ -8,64 +8,135 @@ It provides public access to its fields, so:
   - modify them only if you have to. Do it in organized way or your
     game will work unexpectedly
 """
-import os, sys
+import os, sys, time
+
+from const import *
+
+def argument_value(name, default = None):
+    """ Returns the command line argument that follows name
+    """
+    if name in sys.argv:
+        i = sys.argv.index(name)
+        if i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+    return default
 
 class Config:
-    def __init__(self):
+    def __init__(self, base_path = None):
+        """
+        base_path Directory with game data (gfx, sounds, ...). Defaults
+                  to the directory of the started script
+        """
         ## general stuff
         self.sound = not "--nosounds" in sys.argv
         self.music = not "--nomusic" in sys.argv
+        self.audio_rate = int(argument_value("--audio-rate", 11025)) # samples per second of the mixer
+        self.audio_buffer = int(argument_value("--audio-buffer", 256)) # samples, power of 2. Smaller is less latency, more risk of crackling
+        self.audio_channels = {"loop" : 2, "effect" : 4, "jingle" : 1} # channels reserved for every category of sounds, see audio.py
+        self.audio_stats = "--audio-stats" in sys.argv # print audio latency and dropped plays at exit
         self.resolution = 320,240 # in this resolution the game is blited onto Surface
         self.screen_resolution = 800,600 # just before swap buffers the screen is scaled to this resolution
         self.board_size = 240,240
         self.fullscreen = "--fullscreen" in sys.argv
+        self.video_output = argument_value("--video", "scale") # "scale", "integer", "sdl" or "native", see GameFsm
+        self.video_scale = argument_value("--video-scale") # integer scale factor, by default the largest that fits
+        self.asset_bundle = not "--nobundle" in sys.argv # load animations from cache/animations.bundle
+        self.sprite_atlas = not "--noatlas" in sys.argv # pack all frames into one surface
+        self.loader_threads = 4 # threads decoding sounds at start
+        self.startup_trace = "--startup-trace" in sys.argv # print where the start up time went
+        self.start_time = time.time()
+        self.render = not "--norender" in sys.argv # only with --replay
+        self.record_path = argument_value("--record") # file where the game is recorded
+        self.replay_path = argument_value("--replay") # recorded game to replay
+        self.replay_speed = float(argument_value("--replay-speed", 1))
+        self.net_host_port = argument_value("--host") # host a network game on this port
+        self.net_connect = argument_value("--connect") # "host:port" of a network game to join
+        self.stream_path = argument_value("--stream") # file the spectator stream is written to
+        self.stream_port = argument_value("--stream-port") # port spectators connect to
+        self.watch = argument_value("--watch") # spectator stream file or "host:port" to watch
         self.fps_limit = 60
+        self.input_poll_ms = float(argument_value("--input-poll-ms", 1)) # input is polled this often between frames, 0 - once per frame (saves CPU)
+        self.tick_rate = int(argument_value("--tick-rate", 60)) # updates of the game per second, independent of fps
+        self.max_frame_time = 0.25 # longer frames (i.e. the window was dragged) don't have to be caught up
+        self.interpolation = not "--nointerpolate" in sys.argv # sprites are shown between the last two ticks
+        self.dirty_rects = "--dirty-rects" in sys.argv # redraw and show only changed parts of the screen
+        self.display_frame_stats = "--frame-stats" in sys.argv # overlay with frame time percentiles (key 6)
+        self.frame_stats_window = 300 # frames the percentiles are computed from
+        self.frame_csv_path = argument_value("--frame-csv") # file every frame's times are appended to
         self.grid_cell_size = 7.05, 7.58
-        self.grid_size = 54, 52
         self.display_grid = False
         self.display_target_cells = False
         self.display_position = False
-        self.dots_to_eat = 264 # 260 normal + 4 powerups
+        self.level_path = argument_value("--level") # level file (see level.py), default levels/classic.maze
 
-        self.pacman_position = {
-            "yellow" : (125, 180),
-            "green"  : (112, 180)
-            }
         self.packman_standard_speed = 50
 
-        self.ghost_red_position = 120,90
-        self.ghost_orange_position = 135,110
-        self.ghost_teal_position = 105,110
-        self.ghost_pink_position = 120,110
         self.ghost_speed = 40
         self.ghost_eyes_speed = 200
+        self.ghost_count = int(argument_value("--ghosts", 4)) # colors repeat every 4 ghosts
+        self.ghost_engine = argument_value("--ghost-engine", "objects") # "objects" or "numpy"
+        self.ghost_targeting = argument_value("--ghost-targeting", "euclidean") # "euclidean" or "maze" (path length, see distance.py)
+        self.random_seed = 13 # ghosts' random decisions depend on it
+        self.autopilot = "--autopilot" in sys.argv # pacmans are played by AutopilotController, a new game starts after game over
+        self.start_level = int(argument_value("--start-level", 1))
+
+        # durations of scatter/chase phases, see get_phase_duration
+        self.phase_durations_lvl_1    = [0,7,20,7,20,5,20,  5]
+        self.phase_durations_lvl_2_4  = [0,7,20,7,20,5,1033,0] # 0 is simple reversal of direction
+        self.phase_durations_lvl_gt_5 = [0,5,20,5,20,5,1037,0]
 
         ## paths
-        base_path = os.path.abspath(os.path.dirname(sys.argv[0]))
+        if base_path is None:
+            base_path = os.path.dirname(sys.argv[0])
+        base_path = os.path.abspath(base_path)
         self.__path={}
-        for data_type in ("gfx", "sounds", "music", "font"):
+        for data_type in ("gfx", "sounds", "music", "font", "cache", "levels"):
             self.__path[data_type] = os.path.join(base_path, data_type)
         # you can't inline __add_path_getter method because in python
         # closures are create by function calls
         for k, v in self.__path.items():
             self.__add_path_getter(k,v)
+        if self.level_path is None:
+            self.level_path = self.levels_path("classic.maze")
 
     def __add_path_getter(self, k, v):
             setattr(Config,
                     k + "_path",
                     lambda self_, fname: os.path.join(v, fname))
 
+    def level_cache_path(self):
+        """ Compiled level file (see level.load_level)
+        """
+        name = os.path.splitext(os.path.basename(self.level_path))[0]
+        return self.cache_path(name + ".level")
+
+    def output_scale(self):
+        """ Integer factor of the game resolution used by "integer" and
+        "native" video output
+        """
+        if self.video_scale:
+            return int(self.video_scale)
+        w, h = self.resolution
+        sw, sh = self.screen_resolution
+        return max(1, min(sw / w, sh / h))
+
+    def draw_scale(self):
+        """ Scale of everything drawn by the game. In "native" video
+        output sprites are pre-scaled at load time and drawn directly in
+        the output resolution
+        """
+        if self.video_output == "native":
+            return self.output_scale()
+        return 1
+
     def get_phase_duration(self, level, phase_num):
         """Returns duration of scatter/chase phase in seconds
         """
         if phase_num >= 8:
             return 9999999
-        lvl_1    = [0,7,20,7,20,5,20,  5]
-        lvl_2_4  = [0,7,20,7,20,5,1033,0] # 0 is simple reversal of direction
-        lvl_gt_5 = [0,5,20,5,20,5,1037,0]
         if level == 1:
-            return lvl_1[phase_num]
+            return self.phase_durations_lvl_1[phase_num]
         elif level >= 2 and level <= 4:
-            return lvl_2_4[phase_num]
+            return self.phase_durations_lvl_2_4[phase_num]
         else:
-            return lvl_gt_5[phase_num]
+            return self.phase_durations_lvl_gt_5[phase_num]
@@ -33,3 +33,7 @@ GHOST_SPRITE_EYES_LEFT        = GHOST_SPRITE_EYES + DIR_LEFT
 GHOST_SPRITE_EYES_DOWN        = GHOST_SPRITE_EYES + DIR_DOWN
 GHOST_SPRITE_EYES_RIGHT       = GHOST_SPRITE_EYES + DIR_RIGHT
 GHOST_SPRITE_EYES_UP          = GHOST_SPRITE_EYES + DIR_UP
+
+CELL_WALKABLE                 = 1
+CELL_DOT                      = 2
+CELL_ENERGIZER                = 4
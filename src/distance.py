@@ -0,0 +1,116 @@
+""" Shortest path distances through the maze
+
+Straight line distance leads ghosts into dead ends and makes them
+oscillate in front of walls. DistanceTables gives true path lengths -
+breadth first search over Level.adjacency from a cell gives a table of
+distances to every cell (one byte per cell, UNREACHABLE for walls and
+cells farther than 254 steps). Paths are symmetric, so the table of a
+target cell tells how far every cell is from the target.
+
+Walls don't change during the game. A table is computed the first time
+its cell is asked for and kept, so a ghost pays for a search only when
+its target moves to a cell never seen before - deciding at a cell is a
+few table lookups. All tables of a maze take walkable cells * cells
+bytes at most (about 2.5 MB for the classic level).
+
+Targets of ghosts can be walls or even outside of the maze (i.e. four
+cells in front of pacman). They are replaced by the walkable cell
+nearest to them (see target_index).
+
+Used by ghosts with Config.ghost_targeting "maze" and by
+AutopilotController. The tunnel is not a part of the paths.
+"""
+
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from const import *
+from utils import *
+
+UNREACHABLE = 255 # distances are stored in bytes
+
+class DistanceTables:
+    def __init__(self, level):
+        self.width, self.height = level.maze.size()
+        vectors = [direction_to_vector(direction) for direction in (DIR_LEFT, DIR_DOWN, DIR_RIGHT, DIR_UP)]
+        # (direction, index of the neighbor cell) for every cell
+        self.neighbors = []
+        for i, bits in enumerate(level.adjacency):
+            self.neighbors.append([(direction, i + vectors[direction][1] * self.width + vectors[direction][0])
+                                   for direction in (DIR_LEFT, DIR_DOWN, DIR_RIGHT, DIR_UP)
+                                   if bits & (1 << direction)])
+        self.nearest = self.__nearest_walkable(level.maze)
+        self.tables = {} # cell index -> bytearray of distances
+        self.arrays = {} # cell index -> numpy view of the table
+        self.searches = 0 # count of breadth first searches
+
+    def __nearest_walkable(self, maze):
+        """ For every cell index of the closest walkable cell (in steps
+        through walls too)
+        """
+        w, h = self.width, self.height
+        nearest = [None] * (w * h)
+        queue = deque()
+        for i in range(w * h):
+            if maze.cells[i] & CELL_WALKABLE:
+                nearest[i] = i
+                queue.append(i)
+        while queue:
+            i = queue.popleft()
+            x, y = i % w, i / w
+            for nx, ny in ((x - 1, y), (x, y + 1), (x + 1, y), (x, y - 1)):
+                j = ny * w + nx
+                if 0 <= nx < w and 0 <= ny < h and nearest[j] is None:
+                    nearest[j] = nearest[i]
+                    queue.append(j)
+        return nearest
+
+    def target_index(self, cell):
+        """ Index of the walkable cell nearest to the cell. The cell may
+        be outside of the maze
+        """
+        cx = min(max(int(cell[0]), 0), self.width - 1)
+        cy = min(max(int(cell[1]), 0), self.height - 1)
+        return self.nearest[cy * self.width + cx]
+
+    def distances(self, index):
+        """ Bytearray of path lengths from the cell (index) to every
+        cell
+        """
+        table = self.tables.get(index)
+        if table is not None:
+            return table
+        table = bytearray([UNREACHABLE]) * (self.width * self.height)
+        if index is not None:
+            table[index] = 0
+            neighbors = self.neighbors
+            queue = deque([index])
+            while queue:
+                i = queue.popleft()
+                d = table[i] + 1
+                if d >= UNREACHABLE:
+                    break
+                for direction, j in neighbors[i]:
+                    if table[j] == UNREACHABLE:
+                        table[j] = d
+                        queue.append(j)
+        self.tables[index] = table
+        self.searches += 1
+        return table
+
+    def to_target(self, cell):
+        """ Table of path lengths to the target cell (see target_index)
+        """
+        return self.distances(self.target_index(cell))
+
+    def array(self, index):
+        """ distances as numpy array of uint8 (shares the memory)
+        """
+        array = self.arrays.get(index)
+        if array is None:
+            array = self.arrays[index] = numpy.frombuffer(self.distances(index), dtype = numpy.uint8)
+        return array
@@ -0,0 +1,112 @@
+""" Frame time instrumentation
+
+FrameStats measures every phase of a frame separately (processing of
+events, update, display, scaling and flip), keeps the samples of the
+last frames to compute rolling percentiles and optionally appends every
+frame to a CSV file. The percentiles can be drawn as an overlay over
+the shown frame.
+
+It also collects the input latency - time from a key press to the flip
+of the frame that shows it (see input_queue.py).
+"""
+
+import csv, time
+from collections import deque
+import pygame
+
+PHASES = ["events", "update", "display", "scale", "flip"]
+
+class FrameStats:
+    def __init__(self, window = 300, csv_path = None):
+        """
+        window   Number of last frames the percentiles are computed from
+        csv_path File the per frame times (in ms) are appended to
+        """
+        self.samples = dict((phase, deque(maxlen = window)) for phase in PHASES + ["frame", "input"])
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.current_input = [] # latencies of key presses shown in current frame
+        self.frame_start = 0
+        self.frames = 0
+        self.csv_file = None
+        self.writer = None
+        if csv_path:
+            self.csv_file = open(csv_path, "ab")
+            self.writer = csv.writer(self.csv_file)
+            if self.csv_file.tell() == 0:
+                self.writer.writerow(["frame", "time"] + ["frame_ms"] + [phase + "_ms" for phase in PHASES] +
+                                     ["input_ms"])
+        self.font = None
+        self.overlay = None
+        self.overlay_time = 0
+        self.overlay_period = 0.5 # seconds between refreshes of the overlay
+
+    def start_frame(self):
+        self.frame_start = time.time()
+        for phase in PHASES:
+            self.current[phase] = 0.0
+        self.current_input = []
+
+    def measure(self, phase, f, *args):
+        """ Call f and add its duration to the phase of current frame
+        """
+        start = time.time()
+        result = f(*args)
+        self.current[phase] += time.time() - start
+        return result
+
+    def add_input_latency(self, latency):
+        self.samples["input"].append(latency)
+        self.current_input.append(latency)
+
+    def end_frame(self):
+        now = time.time()
+        frame = now - self.frame_start
+        for phase in PHASES:
+            self.samples[phase].append(self.current[phase])
+        self.samples["frame"].append(frame)
+        self.frames += 1
+        if self.writer:
+            self.writer.writerow([self.frames, "%.3f" % now, "%.3f" % (frame * 1000)] +
+                                 ["%.3f" % (self.current[phase] * 1000) for phase in PHASES] +
+                                 ["%.3f" % (max(self.current_input) * 1000) if self.current_input else ""])
+
+    def percentiles(self, phase):
+        """ p50, p95 and p99 of the phase (or "frame" or "input") over
+        the last frames in seconds
+        """
+        samples = sorted(self.samples[phase])
+        n = len(samples)
+        if n == 0:
+            return 0.0, 0.0, 0.0
+        return tuple(samples[min(n - 1, n * p / 100)] for p in (50, 95, 99))
+
+    def overlay_surface(self):
+        """ Table of percentiles. Rendered again only a few times per
+        second, text rendering would skew the measured frames
+        """
+        now = time.time()
+        if self.overlay is not None and now - self.overlay_time < self.overlay_period:
+            return self.overlay
+        if self.font is None:
+            self.font = pygame.font.Font(None, 16)
+        rows = [["ms", "p50", "p95", "p99"]]
+        for phase in PHASES + ["frame", "input"]:
+            rows.append([phase] + ["%.2f" % (t * 1000) for t in self.percentiles(phase)])
+        # the default font is not monospaced, so columns are placed separately
+        rendered = [[self.font.render(cell, 1, (255, 255, 255)) for cell in row] for row in rows]
+        column_width, line_height = 44, self.font.get_linesize()
+        self.overlay = pygame.Surface((4 * column_width + 8, len(rows) * line_height + 8))
+        for y, row in enumerate(rendered):
+            for x, text in enumerate(row):
+                left = 4 + x * column_width
+                if x > 0: # numbers are aligned to the right
+                    left += column_width - text.get_width()
+                self.overlay.blit(text, (left, 4 + y * line_height))
+        self.overlay_time = now
+        return self.overlay
+
+    def close(self):
+        if self.csv_file:
+            self.csv_file.close()
+            self.csv_file = None
+            self.writer = None
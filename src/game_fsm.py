@@ -3,11 +3,28 @@
 To add new state to the game create new class derived from
 GameState. You can define how to render/update the state
 
+States are updated in fixed ticks of 1 / Config.tick_rate seconds, no
+matter how fast frames are rendered. Time left over from a frame is
+carried to the next one and the state is told how far it is between
+two ticks (GameState.interpolate), so it can display smooth motion.
+
+The states draw onto GameFsm.screen. Config.video_output chooses how
+the screen gets to the display:
+  scale   - scaled to the screen resolution (any factor)
+  integer - scaled by an integer factor, centered with black bars
+  sdl     - shown in the game resolution, SDL scales the window
+            (pygame.SCALED, needs pygame 2 - falls back to integer)
+  native  - the screen has the output size and sprites are pre-scaled
+            at load time (see Config.draw_scale), nothing is scaled
 """
 
+import time
+from fractions import gcd
 import pygame
 from pygame.locals import *
 import config
+from frame_stats import FrameStats
+from input_queue import InputQueue
 
 
 class GameState:
@@ -26,6 +43,29 @@ class GameState:
     def display(self, screen):
         pass
 
+    def interpolate(self, alpha):
+        """ Called before the state is displayed. alpha (0 to 1) is how
+        far the displayed time is from the last update to the next one
+        """
+        pass
+
+    def background(self):
+        """ Surface used to restore dirty rects. None if the state
+        doesn't support dirty rects mode
+        """
+        return None
+
+    def dirty_rects(self):
+        """ Rects that changed since the last frame or None if the
+        whole screen has to be redrawn with display
+        """
+        return None
+
+    def display_foreground(self, screen):
+        """ Draw everything that is not a part of background
+        """
+        pass
+
     def finish(self):
         pass
 
@@ -43,17 +83,41 @@ class GameFsm:
     def __init__(self, cfg):
         self.is_finished = False # if true the main loop will be finished
         self.current_state = null_game_state # which state is executed now
-        self.clock = pygame.time.Clock()
         self.cfg = cfg
+        self.frames = 0
+        self.stats = FrameStats(cfg.frame_stats_window, cfg.frame_csv_path)
+        self.overlay_shown = False
         self.__init_pygame()
+        self.input = InputQueue(self.cfg.input_poll_ms / 1000.0)
+        self.sim_time = None # time (time.time()) the state has been updated to
+        self.pending_events = [] # (time, event) later than sim_time
 
     def __init_pygame(self):
-        pygame.mixer.pre_init(11025, -16, 2, 256)
+        pygame.mixer.pre_init(self.cfg.audio_rate, -16, 2, self.cfg.audio_buffer)
         flags = 0
         if self.cfg.fullscreen:
             flags |= pygame.FULLSCREEN
-        self.video_buffer = pygame.display.set_mode(self.cfg.screen_resolution, flags)
-        self.screen = pygame.Surface(self.cfg.resolution).convert_alpha()
+        output = self.cfg.video_output
+        if output == "sdl" and not hasattr(pygame, "SCALED"):
+            print "pygame.SCALED is not available, using integer video output"
+            output = self.cfg.video_output = "integer"
+        w, h = self.cfg.resolution
+        k = self.cfg.output_scale()
+        size = self.cfg.screen_resolution
+        if output == "sdl":
+            flags |= pygame.SCALED
+            size = self.cfg.resolution
+        elif output in ("integer", "native") and not self.cfg.fullscreen:
+            size = w * k, h * k # no black bars in a window
+        # scaling needs the same pixel format as the screen has
+        self.video_buffer = pygame.display.set_mode(size, flags, 32)
+        s = self.cfg.draw_scale()
+        self.screen = pygame.Surface((w * s, h * s)).convert()
+        # part of the video buffer the screen is shown in
+        self.output_rect = self.video_buffer.get_rect()
+        if output in ("integer", "native"):
+            self.output_rect = pygame.Rect(0, 0, w * k, h * k)
+            self.output_rect.center = self.video_buffer.get_rect().center
         pygame.init()
 
     def set_state(self, new_state):
@@ -66,13 +130,38 @@ class GameFsm:
         """ Shut down the GameFsm """
         self.set_state(null_game_state)
         self.is_finished = True
+        self.stats.close()
 
-    def __process_events(self):
-        for event in pygame.event.get():
-            if event.type == QUIT:
-                self.finish();
-            else:
-                self.current_state.process_event(event)
+    def __process_event(self, stamp, event):
+        if event.type == QUIT:
+            self.finish();
+        else:
+            self.current_state.process_event(event)
+            self.input.processed(stamp, event)
+
+    def __update(self, end):
+        """ Update current state in fixed ticks up to the time end. Events
+        are processed before the first tick that starts after them
+        """
+        stats = self.stats
+        tick = 1.0 / self.cfg.tick_rate
+        if end - self.sim_time > self.cfg.max_frame_time:
+            self.sim_time = end - self.cfg.max_frame_time # don't catch up a stall tick by tick
+        events = self.pending_events + self.input.take()
+        first = 0
+        while True:
+            while first < len(events) and events[first][0] <= self.sim_time:
+                stats.measure("events", self.__process_event, *events[first])
+                first += 1
+                if self.is_finished or self.current_state.is_finished():
+                    self.pending_events = events[first:]
+                    return
+            if self.sim_time + tick > end:
+                break
+            stats.measure("update", self.current_state.update, tick)
+            self.sim_time += tick
+        self.pending_events = events[first:]
+        self.current_state.interpolate((end - self.sim_time) / tick)
 
     def run(self):
         """ Main loop. Updates current state, processes events, renders the scene
@@ -82,17 +171,131 @@ class GameFsm:
         If the state finishes (is_finished returns True) then it is
         not allowed to do any actions (should do nothing)
         """
+        stats = self.stats
+        frame_time = self.sim_time = time.time()
         while not self.is_finished:
-            dt = self.clock.tick(self.cfg.fps_limit) * 0.001
-            self.__process_events()
+            # events that come while waiting are stamped with their time
+            self.input.wait(frame_time + 1.0 / self.cfg.fps_limit)
+            frame_time = time.time()
+            stats.start_frame()
+            self.__update(frame_time)
+            if self.is_finished:
+                break
             if self.current_state.is_finished():
                 self.set_state(self.current_state.new_state())
                 continue
-            self.current_state.update(dt)
 
-            self.current_state.display(self.screen)
-            if (self.cfg.resolution != self.cfg.screen_resolution):
-                pygame.transform.scale(self.screen, self.cfg.screen_resolution, self.video_buffer)
+            rects = None
+            if self.cfg.dirty_rects:
+                rects = stats.measure("display", self.__display_dirty)
+            if rects is None:
+                stats.measure("display", self.current_state.display, self.screen)
+            self.present(rects)
+            stats.end_frame()
+
+    def __display_dirty(self):
+        """ Redraw only parts of the screen changed by current state
+
+        Returns list of redrawn rects or None if the state needs full
+        redraw
+        """
+        background = self.current_state.background()
+        if background is None:
+            return None
+        rects = self.current_state.dirty_rects()
+        if rects is None:
+            return None
+        for rect in rects:
+            self.screen.blit(background, rect, rect)
+        self.current_state.display_foreground(self.screen)
+        return rects
+
+    def present(self, rects = None):
+        """ Copy the screen to the video buffer and show it
+
+        rects Parts of the screen that changed. If None the whole
+              screen is shown
+        """
+        if self.overlay_shown and not self.cfg.display_frame_stats:
+            # the overlay has to be covered by the whole frame
+            self.overlay_shown = False
+            self.video_buffer.fill((0,0,0)) # it could cover the black bars
+            rects = None
+        if rects is None:
+            self.stats.measure("scale", self.__scale_screen)
+            self.__display_overlay()
+            self.stats.measure("flip", pygame.display.flip)
+            self.__frame_shown()
+            return
+
+        updated = self.stats.measure("scale", self.__scale_rects, rects)
+        overlay_rect = self.__display_overlay()
+        if overlay_rect:
+            updated.append(overlay_rect)
+        self.stats.measure("flip", pygame.display.update, updated)
+        self.__frame_shown()
+
+    def __scale_screen(self):
+        if self.screen.get_size() != self.output_rect.size:
+            pygame.transform.scale(self.screen, self.output_rect.size,
+                                   self.video_buffer.subsurface(self.output_rect))
+        else:
+            self.video_buffer.blit(self.screen, self.output_rect)
+
+    def __scale_rects(self, rects):
+        """ Copy rects of the screen to the video buffer. Returns
+        changed rects of the video buffer
+        """
+        screen_rect = self.screen.get_rect()
+        updated = []
+        for rect in rects:
+            rect = self.__align_rect(rect).clip(screen_rect)
+            if rect.width == 0 or rect.height == 0:
+                continue
+            if self.screen.get_size() != self.output_rect.size:
+                video_rect = self.__scale_rect(rect)
+                pygame.transform.scale(self.screen.subsurface(rect), video_rect.size,
+                                       self.video_buffer.subsurface(video_rect))
             else:
-                self.video_buffer.blit(self.screen, (0,0))
-            pygame.display.flip()
+                video_rect = rect.move(self.output_rect.topleft)
+                self.video_buffer.blit(self.screen, video_rect, rect)
+            updated.append(video_rect)
+        return updated
+
+    def __display_overlay(self):
+        """ Draw frame time percentiles over the video buffer if enabled.
+        Returns the covered rect
+        """
+        if not self.cfg.display_frame_stats:
+            return None
+        self.overlay_shown = True
+        return self.video_buffer.blit(self.stats.overlay_surface(), (0, 0))
+
+    def __frame_shown(self):
+        self.frames += 1
+        for latency in self.input.shown():
+            self.stats.add_input_latency(latency)
+        if self.frames == 1 and self.cfg.startup_trace:
+            print "first frame after %.2f ms" % ((time.time() - self.cfg.start_time) * 1000)
+
+    def __align_rect(self, rect):
+        """ Grow rect so that its edges are mapped to whole pixels of
+        the video buffer. Then scaling the rect alone gives the same
+        pixels as scaling whole screen
+        """
+        w, h = self.screen.get_size()
+        vw, vh = self.output_rect.size
+        step_x, step_y = w / gcd(w, vw), h / gcd(h, vh)
+        left, top = rect.left - rect.left % step_x, rect.top - rect.top % step_y
+        right = rect.right + (-rect.right) % step_x
+        bottom = rect.bottom + (-rect.bottom) % step_y
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def __scale_rect(self, rect):
+        """ Map rect on the screen to rect on the video buffer
+        """
+        w, h = self.screen.get_size()
+        vw, vh = self.output_rect.size
+        left, top = rect.left * vw / w, rect.top * vh / h
+        right, bottom = rect.right * vw / w, rect.bottom * vh / h
+        return pygame.Rect(left, top, right - left, bottom - top).move(self.output_rect.topleft)
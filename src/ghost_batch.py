@@ -0,0 +1,429 @@
+""" Ghosts updated all at once with NumPy arrays
+
+Updating every Ghost object separately doesn't scale to hundreds of
+ghosts. GhostBatch keeps positions, directions, states and targets of
+all ghosts in arrays and advances them with array operations. It
+follows the same rules as Ghost (see main.py), the 4 ghosts of the
+classic game move exactly the same with both engines.
+
+NumPy is optional - it is needed only if cfg.ghost_engine is "numpy".
+
+BatchedGhost objects give access to single ghosts of the batch with
+the interface of Ghost, so the game can treat both engines the same
+way outside of the update.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from sprite import Sprite
+from const import *
+from utils import *
+
+GHOST_COLORS = ["red", "teal", "pink", "orange"] # indexed by *_GHOST_ID
+
+class MazeIndexArrays:
+    """ MazeIndex exits as arrays: for every (cell, heading) row and
+    direction column there is a valid flag, the neighbor cell and its
+    position in pixels
+    """
+    def __init__(self, maze_index):
+        self.width = maze_index.width
+        rows = len(maze_index.table)
+        self.valid = numpy.zeros((rows, 4), dtype = bool)
+        self.cell = numpy.zeros((rows, 4, 2), dtype = numpy.int32)
+        self.position = numpy.zeros((rows, 4, 2))
+        for row, exits in enumerate(maze_index.table):
+            for direction, exit in enumerate(exits):
+                if exit is not None:
+                    self.valid[row, direction] = True
+                    self.cell[row, direction] = exit[0]
+                    self.position[row, direction] = exit[1]
+
+    def rows(self, cells, headings):
+        return (cells[:,1] * self.width + cells[:,0]) * 4 + headings
+
+class GhostBatch:
+    def __init__(self, cfg, res, pacmans, random, game, count):
+        """
+        pacmans List of pacmans the ghosts are chasing
+        random  Random shared with the game (frightened ghosts use it)
+        game    PacmanGame (for frightened timer)
+        count   Number of ghosts. Colors and start positions repeat
+                every 4 ghosts (see Level.ghost_setup)
+        """
+        if numpy is None:
+            raise ImportError("GhostBatch needs NumPy")
+        self.cfg = cfg
+        self.res = res
+        self.pacmans = pacmans
+        self.random = random
+        self.game = game
+        self.count = count
+
+        self.level = game.level
+        setup = [self.level.ghost_setup(i) for i in range(count)]
+        self.color_id = numpy.array([GHOST_COLORS.index(color) for color, position, direction in setup])
+        self.position = numpy.array([position for color, position, direction in setup], dtype = float)
+        self.direction = numpy.array([direction for color, position, direction in setup])
+        self.next_direction = self.direction.copy()
+        self.state = numpy.empty(count, dtype = int)
+        self.state.fill(GHOST_STATE_STOPPED)
+        self.frightened = numpy.zeros(count, dtype = bool)
+        self.isdead = numpy.zeros(count, dtype = bool)
+        self.target = numpy.zeros((count, 2), dtype = int)
+        self.target[:] = pacmans[0].position # like in Ghost, it is replaced before it's used
+        self.curr_cell = self.__cells(self.position)
+        self.prev_cell = self.curr_cell.copy()
+        self.previous_position = self.position.copy() # see remember_positions
+
+        # ghost that teal ghosts use to compute their target (red
+        # ghost in classic game)
+        self.red_ghost = 0
+
+        self.vectors = numpy.array([direction_to_vector(direction)
+                                    for direction in (DIR_LEFT, DIR_DOWN, DIR_RIGHT, DIR_UP, DIR_STOP)])
+        # ghosts share sprites - one set per color
+        self.sprite = {}
+        for color in GHOST_COLORS:
+            self.sprite[color] = [ Sprite("ghost-left-"+color, self.res, 0.1),
+                                   Sprite("ghost-down-"+color, self.res, 0.1),
+                                   Sprite("ghost-right-"+color, self.res, 0.1),
+                                   Sprite("ghost-up-"+color, self.res, 0.1),
+                                   Sprite("ghost-frightened", self.res, 0.5),
+                                   Sprite("ghost-frightened-blink", self.res, 0.5),
+                                   Sprite("eyes-left", self.res),
+                                   Sprite("eyes-down", self.res),
+                                   Sprite("eyes-right", self.res),
+                                   Sprite("eyes-up", self.res), ]
+        self.ghosts = [BatchedGhost(self, i) for i in range(count)]
+
+    def set_maze(self, maze, maze_index, maze_arrays = None):
+        """
+        maze_arrays MazeIndexArrays of maze_index. Building them takes
+                    a while, so they can be shared
+        """
+        self.maze = maze
+        self.maze_index = maze_index
+        self.maze_arrays = maze_arrays or MazeIndexArrays(maze_index)
+
+    def __cells(self, positions):
+        """ position_to_cell for array of positions
+        """
+        cw, ch = self.cfg.grid_cell_size
+        cells = numpy.empty(positions.shape, dtype = int)
+        cells[:,0] = numpy.trunc((positions[:,0] - 2) / cw) + 11
+        cells[:,1] = numpy.trunc((positions[:,1] - 2) / ch) + 11
+        return cells
+
+    def __cell_positions(self, cells):
+        """ cell_to_position for array of cells
+        """
+        cw, ch = self.cfg.grid_cell_size
+        positions = numpy.empty(cells.shape)
+        positions[:,0] = (cells[:,0] - 11) * cw + 2
+        positions[:,1] = (cells[:,1] - 11) * ch + 2
+        return positions
+
+    ## state changes
+
+    def start(self, ghosts = None):
+        stopped = self.__select(ghosts) & (self.state == GHOST_STATE_STOPPED)
+        self.state[stopped] = GHOST_STATE_IMPRISONED
+
+    def frighten(self, ghosts = None):
+        alive = self.__select(ghosts) & ~self.isdead
+        self.next_direction[alive] = (self.direction[alive] + 2) % 4
+        self.frightened[alive] = True
+
+    def unfrighten(self, ghosts = None):
+        self.frightened[self.__select(ghosts)] = False
+
+    def scatter(self, ghosts = None):
+        selected = self.__select(ghosts)
+        chasing = selected & (self.state == GHOST_STATE_CHASE)
+        self.next_direction[chasing] = (self.direction[chasing] + 2) % 4
+        self.state[selected] = GHOST_STATE_SCATTER
+
+    def chase(self, ghosts = None):
+        selected = self.__select(ghosts)
+        scattering = selected & (self.state == GHOST_STATE_SCATTER)
+        self.next_direction[scattering] = (self.direction[scattering] + 2) % 4
+        self.state[selected] = GHOST_STATE_CHASE
+
+    def __select(self, ghosts):
+        """ Mask of ghosts with given indices (all ghosts if None)
+        """
+        mask = numpy.zeros(self.count, dtype = bool)
+        if ghosts is None:
+            mask[:] = True
+        else:
+            mask[ghosts] = True
+        return mask
+
+    ## update
+
+    def update(self, dt):
+        # Ghost objects are updated one by one and teal ghosts look at
+        # the already moved red ghost. Update the red ghost first to
+        # get the same result
+        first = self.__select([self.red_ghost])
+        self.__update_ghosts(dt, first)
+        self.__update_ghosts(dt, ~first)
+        for sprites in self.sprite.values():
+            for sprite in sprites:
+                sprite.update(dt)
+
+    def __update_ghosts(self, dt, mask):
+        imprisoned = mask & (self.state == GHOST_STATE_IMPRISONED)
+        playing = mask & ((self.state == GHOST_STATE_CHASE) | (self.state == GHOST_STATE_SCATTER))
+        if imprisoned.any():
+            self.__update_imprisoned(imprisoned)
+        if playing.any():
+            self.__update_playing(playing)
+
+        # compute new position
+        moving = mask & (self.state != GHOST_STATE_STOPPED)
+        speed = numpy.where(self.isdead, self.cfg.ghost_eyes_speed, self.cfg.ghost_speed)
+        step = self.vectors[self.direction] * (dt * speed)[:,numpy.newaxis]
+        position = self.position + step
+        # tunnel
+        x = position[:,0]
+        low, high = self.level.tunnel
+        x[x > high] = low
+        x[x < low] = high
+        self.position[moving] = position[moving]
+
+    def __update_imprisoned(self, mask):
+        """ While imprisoned ghosts wander up and down doing nothing
+        """
+        self.state[mask & (self.color_id == RED_GHOST_ID)] = GHOST_STATE_CHASE
+        y = self.position[:,1]
+        top, bottom = self.level.prison
+        up = mask & (self.direction == DIR_UP) & (y <= top)
+        down = mask & (self.direction == DIR_DOWN) & (y > bottom)
+        self.direction[up] = DIR_DOWN
+        self.direction[down] = DIR_UP
+
+    def __update_playing(self, mask):
+        """ See Ghost.__update_playing
+        """
+        home = numpy.array(self.level.home)
+        revived = mask & self.isdead & (self.curr_cell == home).all(axis = 1)
+        self.isdead[revived] = False
+
+        cells = self.__cells(self.position)
+        self.curr_cell[mask] = cells[mask]
+        cw, ch = self.cfg.grid_cell_size
+        centers = self.__cell_positions(cells) + (cw / 2, ch / 2)
+
+        # ghost must pass cell center if he wants to turn
+        x, y = self.position[:,0], self.position[:,1]
+        cx, cy = centers[:,0], centers[:,1]
+        direction = self.direction
+        not_passed = (((direction == DIR_LEFT) & (x > cx)) |
+                      ((direction == DIR_RIGHT) & (x < cx)) |
+                      ((direction == DIR_UP) & (y > cy)) |
+                      ((direction == DIR_DOWN) & (y < cy)))
+        new_cell = (cells != self.prev_cell).any(axis = 1)
+        deciding = mask & ~not_passed & new_cell
+        if not deciding.any():
+            return
+
+        self.prev_cell[deciding] = cells[deciding]
+        self.direction[deciding] = self.next_direction[deciding]
+        self.position[deciding] = centers[deciding]
+        self.__choose_targets(deciding)
+        self.__pursue_targets(deciding)
+
+    def __choose_targets(self, mask):
+        dead = mask & self.isdead
+        self.target[dead] = self.level.home
+        frightened = mask & ~self.isdead & self.frightened
+        if frightened.any():
+            self.__frightened_targets(frightened)
+
+        chasing = mask & ~self.isdead & ~self.frightened
+        if not chasing.any():
+            return
+        scatter = self.state == GHOST_STATE_SCATTER
+        pacman_cell, pacman_direction = self.__closest_pacmans()
+        color = self.color_id
+
+        red = chasing & (color == RED_GHOST_ID)
+        self.target[red] = pacman_cell[red]
+
+        pink = chasing & (color == PINK_GHOST_ID)
+        self.target[pink] = (pacman_cell + self.vectors[pacman_direction] * 4)[pink]
+
+        teal = chasing & (color == TEAL_GHOST_ID)
+        red_cell = numpy.array(position_to_cell(self.cfg.grid_cell_size, self.position[self.red_ghost]))
+        self.target[teal] = (2 * pacman_cell - red_cell)[teal]
+
+        orange = chasing & (color == ORANGE_GHOST_ID)
+        # distance in cells, not in pixels
+        far = ((pacman_cell - self.__cells(self.position)) ** 2).sum(axis = 1) >= 64
+        self.target[orange & far] = pacman_cell[orange & far]
+        scatter_target = self.level.scatter
+        self.target[orange & ~far] = scatter_target["orange"]
+
+        self.target[red & scatter] = scatter_target["red"]
+        self.target[pink & scatter] = scatter_target["pink"]
+        self.target[teal & scatter] = scatter_target["teal"]
+        self.target[orange & scatter] = scatter_target["orange"]
+
+    def __closest_pacmans(self):
+        """ Cell and direction of the closest pacman for every ghost
+
+        Like Ghost.__get_closest_pacman the first pacman is taken into
+        account even if he is dead
+        """
+        positions = numpy.array([pacman.position for pacman in self.pacmans], dtype = float)
+        alive = numpy.array([i == 0 or pacman.is_alive() for i, pacman in enumerate(self.pacmans)])
+        delta = positions[numpy.newaxis,:,:] - self.position[:,numpy.newaxis,:]
+        distance = (delta ** 2).sum(axis = 2)
+        distance[:,~alive] = numpy.inf
+        closest = distance.argmin(axis = 1)
+        cells = self.__cells(positions)
+        directions = numpy.array([pacman.direction for pacman in self.pacmans])
+        return cells[closest], directions[closest]
+
+    def __frightened_targets(self, mask):
+        """ Random exit - see Ghost.__frightened_target
+        """
+        indices = numpy.flatnonzero(mask)
+        # draw random numbers in the same order as Ghost objects would
+        first = numpy.array([self.random.integer(DIR_LEFT, DIR_UP) for i in indices])
+        arrays = self.maze_arrays
+        rows = arrays.rows(self.curr_cell[indices], self.direction[indices])
+        order = (first[:,numpy.newaxis] + numpy.arange(4)) % 4
+        valid = arrays.valid[rows[:,numpy.newaxis], order]
+        found = valid.any(axis = 1)
+        choice = order[numpy.arange(len(rows)), valid.argmax(axis = 1)]
+        cells = arrays.cell[rows, choice]
+        self.target[indices[found]] = cells[found]
+
+    def __pursue_targets(self, mask):
+        """ Choose exit closest to the target - see Ghost.__pursue_target
+        """
+        indices = numpy.flatnonzero(mask)
+        arrays = self.maze_arrays
+        rows = arrays.rows(self.curr_cell[indices], self.direction[indices])
+        target = self.__cell_positions(self.target[indices])
+        delta = target[:,numpy.newaxis,:] - arrays.position[rows]
+        distance = (delta ** 2).sum(axis = 2)
+        distance[~arrays.valid[rows]] = numpy.inf
+        if self.cfg.ghost_targeting == "maze":
+            # only exits with the shortest path, euclidean distance on ties
+            lengths = self.__path_lengths(indices, rows).astype(float)
+            lengths[~arrays.valid[rows]] = numpy.inf
+            distance[lengths > lengths.min(axis = 1)[:,numpy.newaxis]] = numpy.inf
+        # Ghost tries directions in this order and keeps the first best
+        order = numpy.array([DIR_UP, DIR_LEFT, DIR_DOWN, DIR_RIGHT])
+        distance = distance[:,order]
+        best = distance.argmin(axis = 1)
+        found = numpy.isfinite(distance[numpy.arange(len(rows)), best])
+        self.next_direction[indices[found]] = order[best[found]]
+
+    def __path_lengths(self, indices, rows):
+        """ Path lengths from exits of the ghosts to their targets (see
+        distance.py), one table per distinct target
+        """
+        tables = self.game.distance_tables
+        targets = [tables.target_index(cell) for cell in self.target[indices].tolist()]
+        unique = sorted(set(targets))
+        stack = numpy.array([tables.array(index) for index in unique])
+        which = numpy.searchsorted(unique, targets)
+        cells = self.maze_arrays.cell[rows]
+        exits = cells[:,:,1] * self.maze_arrays.width + cells[:,:,0]
+        return stack[which[:,numpy.newaxis], exits]
+
+    ## queries
+
+    def remember_positions(self):
+        """ Call it at the start of every tick. Positions are shown
+        interpolated between the remembered and the current ones
+        """
+        self.previous_position[:] = self.position
+
+    def in_cell(self, cell, first = 0):
+        """ Indices of ghosts that are alive and are in the cell
+
+        first Only ghosts with this or greater index are checked
+        """
+        cells = self.__cells(self.position[first:])
+        return numpy.flatnonzero(~self.isdead[first:] & (cells == cell).all(axis = 1)) + first
+
+    def sprite_id(self, i):
+        if self.isdead[i]:
+            return GHOST_SPRITE_EYES + self.direction[i]
+        elif self.frightened[i]:
+            if abs(self.game.frightened_timer - 1.0) < 0.1: # blink when frighten mode is about to finish
+                return GHOST_SPRITE_FRIGHTENED_BLINK
+            elif abs(self.game.frightened_timer - 0.50) < 0.1:
+                return GHOST_SPRITE_FRIGHTENED_BLINK
+            else:
+                return GHOST_SPRITE_FRIGHTENED
+        else:
+            return self.direction[i]
+
+class BatchedGhost(object):
+    """ One ghost of GhostBatch with the interface of Ghost
+    """
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+        self.cfg = batch.cfg
+        self.color = GHOST_COLORS[batch.color_id[index]]
+
+    position   = property(lambda self: tuple(self.batch.position[self.index]))
+    direction  = property(lambda self: int(self.batch.direction[self.index]))
+    state      = property(lambda self: int(self.batch.state[self.index]))
+    frightened = property(lambda self: bool(self.batch.frightened[self.index]))
+    target     = property(lambda self: tuple(self.batch.target[self.index]))
+    curr_cell  = property(lambda self: tuple(self.batch.curr_cell[self.index]))
+
+    def __get_isdead(self):
+        return bool(self.batch.isdead[self.index])
+
+    def __set_isdead(self, isdead):
+        self.batch.isdead[self.index] = isdead
+
+    isdead = property(__get_isdead, __set_isdead)
+
+    def start(self):
+        self.batch.start([self.index])
+
+    def frighten(self):
+        self.batch.frighten([self.index])
+
+    def unfrighten(self):
+        self.batch.unfrighten([self.index])
+
+    def scatter(self):
+        self.batch.scatter([self.index])
+
+    def chase(self):
+        self.batch.chase([self.index])
+
+    def update(self, dt):
+        """ Ghosts of a batch are updated by GhostBatch.update
+        """
+        pass
+
+    def sprite_id(self):
+        return self.batch.sprite_id(self.index)
+
+    def __sprite(self):
+        return self.batch.sprite[self.color][self.batch.sprite_id(self.index)]
+
+    def __shown_position(self, alpha):
+        return interpolate(tuple(self.batch.previous_position[self.index]), self.position, alpha)
+
+    def rect(self, alpha = 1):
+        return self.__sprite().rect(self.__shown_position(alpha))
+
+    def display(self, screen, alpha = 1):
+        self.__sprite().display(screen, self.__shown_position(alpha))
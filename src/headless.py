@@ -0,0 +1,113 @@
+""" Runs the game without a window, sounds and frame rate limit
+
+HeadlessGame drives PacmanGame with a fixed time step. It is meant for
+automated testing and balancing - thousands of games can be simulated
+without watching them:
+
+    game = HeadlessGame()
+    while not game.is_over() and game.ticks < 10000:
+        game.step([DIR_LEFT])
+"""
+
+from config import Config
+from resources import Resources
+from main import PacmanGame
+from snapshot import snapshot, restore
+from const import *
+
+class PlaceholderAnimations(dict):
+    """ Animations with one empty frame for every name
+
+    Sprites only need to know how many frames an animation has. Game
+    rules never look at the frames
+    """
+    def __missing__(self, name):
+        return [None]
+
+class HeadlessResources(Resources):
+    """ Resources that don't need display nor mixer
+
+    Nothing is loaded - the game loads its level itself. There are no
+    sounds, music and fonts
+    """
+    def __init__(self, cfg):
+        Resources.__init__(self, cfg)
+        self.animation = PlaceholderAnimations()
+        self.scale = 1
+
+    def load_all(self):
+        pass
+
+class HeadlessGame:
+    def __init__(self, cfg = None, players = 1, dt = None, res = None, recorder = None):
+        """
+        cfg     Configuration. Sounds and music are turned off in it
+        players Number of pacmans (1 or 2)
+        dt      Duration of one step in seconds. Defaults to one frame
+                of cfg.fps_limit
+        res     HeadlessResources shared by many games
+        recorder replay.Recorder that records the game
+        """
+        if cfg is None:
+            cfg = Config()
+        cfg.sound = False
+        cfg.music = False
+        if res is None:
+            res = HeadlessResources(cfg)
+            res.load_all()
+        self.cfg = cfg
+        self.res = res
+        self.dt = dt if dt is not None else 1.0 / cfg.fps_limit
+        self.ticks = 0
+        self.elapsed = 0 # simulated time in seconds
+        self.recorder = recorder
+        self.game = PacmanGame(cfg, res)
+        self.game.init(None)
+        if players > 1:
+            self.game.add_green_pacman()
+
+    def step(self, inputs = None):
+        """ Advance the game by one time step
+
+        inputs Sequence with new direction of every pacman (DIR_*) or
+               None if the pacman doesn't change his direction
+
+        The game is started right away (also after pacman's death)
+        instead of waiting for a key press
+        """
+        self.game.start_game()
+        if inputs:
+            for pacman, direction in zip(self.game.pacman, inputs):
+                if direction is not None:
+                    pacman.next_direction = direction
+        self.game.control()
+        if self.recorder:
+            self.recorder.tick(self.game, self.dt)
+        self.game.update(self.dt)
+        if self.recorder:
+            self.recorder.game_updated(self.game)
+        self.ticks += 1
+        self.elapsed += self.dt
+
+    def run(self, policy, max_ticks):
+        """ Step until the game is over or max_ticks is reached
+
+        policy Function called before every step with this object. It
+               returns inputs for step
+        """
+        while self.ticks < max_ticks and not self.is_over():
+            self.step(policy(self))
+
+    def snapshot(self):
+        """ State of the game to branch from later (see snapshot.py)
+        """
+        return snapshot(self.game)
+
+    def restore(self, data):
+        """ Return the game to the state of snapshot. Counters of ticks
+        and time are kept
+        """
+        restore(self.game, data)
+
+    def is_over(self):
+        return self.game.is_game_over()
@@ -0,0 +1,79 @@
+""" Timestamped input
+
+pygame events don't carry the time they happened. InputQueue takes the
+events from SDL every Config.input_poll_ms milliseconds while GameFsm
+waits for the next frame, so every event gets the time it arrived.
+GameFsm then processes the events before the first tick after them: a
+key press changes pacman's direction at the moment it was pressed, not
+at the start of the next frame.
+
+Every poll wakes the process up. On low power machines polling can be
+turned off (--input-poll-ms 0) - the wait sleeps until the frame and
+the events get the time of the frame.
+
+Only event types the states use get into the SDL queue, mouse motion
+and other events are blocked.
+
+The time from a key press to the flip of the first frame that shows its
+effect is the input latency (see FrameStats).
+"""
+
+import time
+from collections import deque
+import pygame
+from pygame.locals import *
+
+from audio import LOOP_EVENTS
+
+ALLOWED_EVENTS = [QUIT, KEYDOWN, KEYUP] + LOOP_EVENTS
+
+class InputQueue:
+    def __init__(self, poll_interval = 0.001):
+        """
+        poll_interval Seconds between polls while waiting, 0 to sleep
+                      until the end of the wait
+        """
+        self.poll_interval = poll_interval
+        pygame.event.set_blocked(None) # blocks all event types
+        pygame.event.set_allowed(ALLOWED_EVENTS)
+        self.events = deque() # (time, event)
+        self.unseen = [] # times of key presses not shown on the screen yet
+
+    def poll(self):
+        """ Take events from SDL and stamp them with the current time
+        """
+        now = time.time()
+        for event in pygame.event.get():
+            self.events.append((now, event))
+
+    def wait(self, until):
+        """ Sleep until the time (time.time()), polling events
+        """
+        while True:
+            self.poll()
+            remaining = until - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, self.poll_interval or remaining))
+
+    def take(self):
+        """ List of (time, event) of all polled events, oldest first
+        """
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+    def processed(self, stamp, event):
+        """ Call it when the event was passed to the game
+        """
+        if event.type == KEYDOWN:
+            self.unseen.append(stamp)
+
+    def shown(self):
+        """ Call it right after the flip. Returns latencies (in seconds)
+        of the key presses that are shown now
+        """
+        now = time.time()
+        latencies = [now - stamp for stamp in self.unseen]
+        self.unseen = []
+        return latencies
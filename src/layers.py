@@ -0,0 +1,218 @@
+""" Pre-rendered parts of the scene
+
+Drawing the same static things every frame is wasteful. Layers render
+their content once into a Surface and later patch only the parts that
+changed.
+"""
+
+import pygame
+
+import color
+from const import *
+from utils import *
+
+def opaque(surface):
+    """ The backgrounds are opaque, blitting them without per pixel
+    alpha is much faster. Conversion needs a display
+    """
+    if pygame.display.get_surface() is None:
+        return surface
+    result = pygame.Surface(surface.get_size()).convert()
+    result.blit(surface, (0,0))
+    return result
+
+def cell_dot_position(grid_cell_size, cell):
+    """ Where the dot (or energizer) of the cell is drawn
+    """
+    px, py = cell_to_position(grid_cell_size, cell)
+    return (px + 4, py + 4)
+
+class DotLayer:
+    """ Maze background with all not eaten dots drawn on it
+
+    The layer is rendered once per level, when it is displayed for
+    the first time (so the game can run without a display). When a dot
+    is eaten only its cell is restored from the background. Energizers
+    blink, so they are not part of the layer - they are drawn over it
+    every frame
+    """
+    def __init__(self, cfg, background, dot, powerup):
+        """
+        background Sprite with the maze image
+        dot        Sprite of small dot
+        powerup    Sprite of energizer (animated)
+        """
+        self.cfg = cfg
+        self.background = background
+        self.dot = dot
+        self.powerup = powerup
+        self.maze = None
+        self.surface = None
+        self.energizers = []
+        self.pending = []
+
+    def render(self, maze):
+        """ Render all dots of the maze. Call it when the level starts
+        """
+        self.maze = maze
+        self.surface = None
+
+    def __render(self):
+        maze = self.maze
+        self.surface = self.background.current_frame().copy()
+        self.energizers = []
+        self.pending = []
+        w, h = maze.size()
+        for cy in range(h):
+            for cx in range(w):
+                flags = maze.flags((cx, cy))
+                if flags & CELL_ENERGIZER:
+                    self.energizers.append((cx, cy))
+                elif flags & CELL_DOT:
+                    self.dot.display(self.surface, cell_dot_position(self.cfg.grid_cell_size, (cx, cy)))
+        self.surface = opaque(self.surface)
+
+    def eat(self, cell, eaten):
+        """ Remove the dot from the layer. eaten are flags returned by Maze.eat
+
+        The surface is patched lazily in display, so it is safe to call
+        it from update
+        """
+        if self.surface is None: # not rendered yet - maze is up to date
+            return
+        if eaten & CELL_ENERGIZER:
+            if cell in self.energizers:
+                self.energizers.remove(cell)
+        elif eaten & CELL_DOT:
+            self.pending.append(cell)
+
+    def dot_rect(self, cell):
+        return self.dot.rect(cell_dot_position(self.cfg.grid_cell_size, cell))
+
+    def energizer_rects(self):
+        return [self.powerup.rect(cell_dot_position(self.cfg.grid_cell_size, cell))
+                for cell in self.energizers]
+
+    def flush(self):
+        """ Restore background of eaten dots. Returns list of patched rects
+        """
+        if self.surface is None:
+            self.__render()
+        rects = []
+        if self.pending:
+            background = self.background.current_frame()
+            for cell in self.pending:
+                rect = self.dot_rect(cell)
+                self.surface.blit(background, rect.topleft, rect)
+                rects.append(rect)
+            self.pending = []
+        return rects
+
+    def display(self, screen):
+        self.flush()
+        screen.blit(self.surface, (0,0))
+
+    def display_energizers(self, screen):
+        for cell in self.energizers:
+            self.powerup.display(screen, cell_dot_position(self.cfg.grid_cell_size, cell))
+
+class HudLayer:
+    """ The HUD panel rendered into its own Surface
+
+    The panel is described by a list of items. The Surface is redrawn
+    only when the list changes and text of every item is rasterized
+    only once - rendered texts are cached
+    """
+    max_cached_texts = 64
+
+    def __init__(self, res, background, sprites):
+        """
+        background Sprite with the panel image
+        sprites    dictionary of Sprites that can be drawn on the panel
+        """
+        self.res = res
+        self.background = background
+        self.sprites = sprites
+        self.surface = None
+        self.items = None
+        self.texts = {}
+
+    def update(self, items):
+        """ Set content of the panel. Returns True if the panel changed
+
+        items list of ("text", position, font size, text, color) and
+              ("sprite", position, sprite name) tuples. Positions are
+              relative to the top left corner of the panel
+        """
+        if items == self.items:
+            return False
+        self.items = items
+        if self.surface is None:
+            self.surface = opaque(self.background.current_frame())
+        self.surface.blit(self.background.current_frame(), (0,0))
+        for item in items:
+            if item[0] == "text":
+                kind, position, size, text, color = item
+                self.surface.blit(self.text(size, text, color), scaled(self.res.scale, position))
+            elif item[0] == "sprite":
+                kind, position, name = item
+                self.sprites[name].display(self.surface, position)
+        return True
+
+    def text(self, size, text, color):
+        key = size, text, color
+        try:
+            return self.texts[key]
+        except KeyError:
+            if len(self.texts) >= self.max_cached_texts:
+                self.texts.clear()
+            surface = self.texts[key] = self.res.font_render("LESSERCO", size, text, color)
+            return surface
+
+    def rect(self, position):
+        return self.surface.get_rect(topleft = scaled(self.res.scale, position))
+
+    def display(self, screen, position):
+        screen.blit(self.surface, scaled(self.res.scale, position))
+
+def hud_items(game):
+    """ Content of the HUD panel of PacmanGame (or of an object with
+    the same attributes, see state_stream.GameView). See HudLayer.update
+
+    Timers are rounded to the displayed precision so that the panel
+    changes only a few times per second
+    """
+    items = [("text", (10, 10), 24, "LEVEL:", (255,0,0)),
+             ("text", (10, 30), 24, str(game.level_num), (255,255,0)),
+             ("text", (10, 50), 24, "POINTS:", (255,0,0))]
+    pos_y = 70
+    for pacman in game.pacman:
+        if not pacman.is_alive():
+            continue
+        items.append(("text", (10, pos_y), 24, str(pacman.points), color.by_name[pacman.color]))
+        pos_y += 20
+
+    items.append(("text", (10, pos_y), 24, "LIVES:", color.by_name["red"]))
+    pos_y += 10+20
+    for pacman in game.pacman:
+        if not pacman.is_alive():
+            continue
+        pos_x = 10
+        for life in range(pacman.lives):
+            items.append(("sprite", (pos_x, pos_y), pacman.color))
+            pos_x += 12
+        pos_y += 20
+
+    if game.frighten_mode:
+        items.append(("text", (10, 140), 24, "FRIGHTEN", (255,0,0)))
+        items.append(("text", (10, 160), 24, "%.1f" % game.frightened_timer, (255,0,0)))
+
+    phase_name = ""
+    if game.phase == GAME_PHASE_SCATTER:
+        phase_name = "scatter"
+    elif game.phase == GAME_PHASE_CHASE:
+        phase_name = "chase"
+    items.append(("text", (10, 180), 24, "Phase:", (255,0,0)))
+    items.append(("text", (10, 200), 24, phase_name, (255,0,0)))
+    items.append(("text", (10, 220), 24, "%.1f" % game.phase_timer, (255,0,0)))
+    return items
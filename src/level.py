@@ -0,0 +1,240 @@
+""" Levels described in text files
+
+A level file (levels/*.maze) describes the maze and where things are in
+it. Lines before the map are a keyword and values, # starts a comment:
+
+    name       classic
+    background level            animation drawn under the maze
+    size       54 52            width and height of the maze in cells
+    pacman     yellow 125 180   start position of a pacman (pixels)
+    ghost      red 120 90 left  color, start position and direction of
+                                a ghost. Ghosts of the game take these
+                                in turn
+    home       27 22            cell dead ghosts return to
+    prison     108 113          imprisoned ghosts move between these y
+    door       119 90           x of the ghost house door and y where
+                                the ghost leaving the house is out
+    scatter    red 41 9         target cell of the ghost in scatter mode
+    tunnel     -4 248           x where moving objects wrap around
+    map
+
+Rows of the maze follow the map line, one character per cell: ' ' wall,
+'-' floor, '.' dot, 'o' energizer. Missing rows and cells are walls.
+
+Parsing the text and deriving the data the game needs is done once -
+load_level stores the level in a binary cache file and later loads it
+from there:
+
+    magic, uint32 length of the header, header (JSON with the
+    description of the level and size and modification time of the
+    source), cells, adjacency, uint16 count of dots, dot cells, uint16
+    count of energizers, energizer cells
+
+Adjacency is a byte per cell with bit 1 << DIR_* set if the neighbor in
+the direction is walkable. Cells of dots and energizers are (byte x,
+byte y) pairs.
+"""
+
+import os, json, struct
+
+from maze import Maze
+from const import *
+from utils import *
+
+LEVEL_MAGIC = "P4TL\x01"
+
+MAP_CHARS = {" " : 0,
+             "-" : CELL_WALKABLE,
+             "." : CELL_WALKABLE | CELL_DOT,
+             "o" : CELL_WALKABLE | CELL_ENERGIZER}
+
+DIRECTIONS = {"left" : DIR_LEFT, "down" : DIR_DOWN, "right" : DIR_RIGHT, "up" : DIR_UP}
+
+class Level:
+    """ Maze of a level with the derived data and its description
+
+    description dictionary with the values of the level file (see
+                parse_level)
+    """
+    def __init__(self, description, maze, adjacency, dots, energizers):
+        self.description = description
+        # str - the cache stores the strings as unicode
+        self.name = str(description["name"])
+        self.background = str(description["background"])
+        self.pacman_start = dict((str(color), tuple(position))
+                                 for color, position in description["pacman"].items())
+        self.ghost_start = [(str(color), tuple(position), direction)
+                            for color, position, direction in description["ghost"]]
+        self.home = tuple(description["home"])
+        self.prison = tuple(description["prison"])
+        self.door = tuple(description["door"])
+        self.scatter = dict((str(color), tuple(cell))
+                            for color, cell in description["scatter"].items())
+        self.tunnel = tuple(description["tunnel"])
+        self.maze = maze
+        self.adjacency = adjacency
+        self.dots = dots
+        self.energizers = energizers
+        self.dots_to_eat = len(dots) # the level is finished when all dots are eaten
+
+    def ghost_setup(self, index):
+        """ Returns color, initial position and direction of index-th ghost
+        """
+        return self.ghost_start[index % len(self.ghost_start)]
+
+    def wrap(self, x):
+        """ x of an object that went through the tunnel
+        """
+        low, high = self.tunnel
+        if x > high:
+            return low
+        if x < low:
+            return high
+        return x
+
+def parse_level(text):
+    """ Description (dictionary) and rows of the map of the level file
+    """
+    description = {"name" : "", "background" : "level", "pacman" : {},
+                   "ghost" : [], "scatter" : {}}
+    lines = text.splitlines()
+    for number, line in enumerate(lines):
+        words = line.split("#", 1)[0].split()
+        if not words:
+            continue
+        keyword, values = words[0], words[1:]
+        try:
+            if keyword == "map":
+                return description, lines[number + 1:]
+            elif keyword in ("name", "background"):
+                description[keyword] = values[0]
+            elif keyword in ("size", "home", "prison", "door", "tunnel"):
+                description[keyword] = [number_value(v) for v in values[:2]]
+            elif keyword in ("pacman", "scatter"):
+                description[keyword][values[0]] = [number_value(v) for v in values[1:3]]
+            elif keyword == "ghost":
+                description["ghost"].append([values[0], [number_value(v) for v in values[1:3]],
+                                             DIRECTIONS[values[3]]])
+            else:
+                raise ValueError("unknown keyword %s" % keyword)
+        except (IndexError, KeyError, ValueError), e:
+            raise ValueError("line %d: %s (%s)" % (number + 1, line.strip(), e))
+    raise ValueError("the level has no map")
+
+def number_value(text):
+    if "." in text:
+        return float(text)
+    return int(text)
+
+def compile_level(text):
+    """ Level built from the text of a level file
+    """
+    description, rows = parse_level(text)
+    for keyword in ("size", "home", "prison", "door", "tunnel"):
+        if keyword not in description:
+            raise ValueError("the level has no %s" % keyword)
+    if not description["ghost"]:
+        raise ValueError("the level has no ghosts")
+    for color, position, direction in description["ghost"]:
+        if color not in description["scatter"]:
+            raise ValueError("the level has no scatter target of %s ghost" % color)
+    width, height = description["size"]
+    maze = Maze((width, height))
+    for cy, row in enumerate(rows[:height]):
+        for cx, char in enumerate(row[:width]):
+            if char not in MAP_CHARS:
+                raise ValueError("unknown map character %r in row %d" % (char, cy + 1))
+            maze.cells[cy * width + cx] = MAP_CHARS[char]
+
+    adjacency = bytearray(width * height)
+    dots = []
+    energizers = []
+    for cy in range(height):
+        for cx in range(width):
+            flags = maze.flags((cx, cy))
+            if not flags & CELL_WALKABLE:
+                continue
+            if flags & CELL_DOT:
+                dots.append((cx, cy))
+            if flags & CELL_ENERGIZER:
+                energizers.append((cx, cy))
+            neighbors = 0
+            for direction in (DIR_LEFT, DIR_DOWN, DIR_RIGHT, DIR_UP):
+                dx, dy = direction_to_vector(direction)
+                nx, ny = cx + dx, cy + dy
+                if 0 <= nx < width and 0 <= ny < height and maze.is_walkable((nx, ny)):
+                    neighbors |= 1 << direction
+            adjacency[cy * width + cx] = neighbors
+    return Level(description, maze, adjacency, dots, energizers)
+
+def write_level(path, level, stamp):
+    """ Store the level in a cache file. stamp describes the source
+    """
+    header = dict(level.description)
+    header["source"] = stamp
+    header = json.dumps(header)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = path + ".tmp"
+    f = open(tmp_path, "wb")
+    f.write(LEVEL_MAGIC)
+    f.write(struct.pack("<I", len(header)))
+    f.write(header)
+    f.write(level.maze.cells)
+    f.write(level.adjacency)
+    for cells in (level.dots, level.energizers):
+        f.write(struct.pack("<H", len(cells)))
+        f.write("".join(struct.pack("<BB", cx, cy) for cx, cy in cells))
+    f.close()
+    os.rename(tmp_path, path) # readers never see half written level
+
+def read_level(path, stamp):
+    """ Level from a cache file or None if the file doesn't exist, is
+    broken or was compiled from a source with other stamp
+    """
+    try:
+        data = open(path, "rb").read()
+    except IOError:
+        return None
+    if not data.startswith(LEVEL_MAGIC):
+        return None
+    try:
+        pos = len(LEVEL_MAGIC)
+        size, = struct.unpack_from("<I", data, pos)
+        pos += 4
+        description = json.loads(data[pos:pos + size])
+        pos += size
+        if description.pop("source") != stamp:
+            return None
+        width, height = description["size"]
+        cells = bytearray(data[pos:pos + width * height])
+        pos += width * height
+        adjacency = bytearray(data[pos:pos + width * height])
+        pos += width * height
+        lists = []
+        for i in range(2):
+            count, = struct.unpack_from("<H", data, pos)
+            pos += 2
+            raw = bytearray(data[pos:pos + 2 * count])
+            lists.append(zip(raw[0::2], raw[1::2]))
+            pos += 2 * count
+        return Level(description, Maze((width, height), cells), adjacency, *lists)
+    except (ValueError, KeyError, struct.error):
+        return None
+
+def load_level(path, cache_path):
+    """ Level from the level file. It is compiled only when its cache
+    file is missing or out of date
+    """
+    stat = os.stat(path)
+    stamp = [stat.st_mtime, stat.st_size]
+    level = read_level(cache_path, stamp)
+    if level is not None:
+        return level
+    level = compile_level(open(path).read())
+    try:
+        write_level(cache_path, level, stamp)
+    except (IOError, OSError), e: # i.e. read only installation
+        print "Can't write level cache:", e
+    return level
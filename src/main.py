@@ -7,50 +7,28 @@ from config import Config
 from game_fsm import GameState, GameFsm
 from sprite import Sprite
 from resources import Resources
+from maze import MazeIndex
+from level import load_level
+from ghost_batch import GhostBatch, MazeIndexArrays
+from layers import DotLayer, HudLayer, hud_items
+from atlas import RenderQueue
+from occupancy import CellOccupancy
+from snapshot import snapshot, restore
+from replay import Recorder, RecordingState, ReplayState, replay_headless
+from network import HostState, ClientState
+from spectator import SpectatorStream, SpectatorState
+from audio import LOOP_EVENTS
+from autopilot import AutopilotController
+from distance import DistanceTables, UNREACHABLE
 from const import *
 from utils import *
 from random import *
 
-def cells_euclidean_2d_distance_squared(grid_cell_size, cell0, cell1):
-    pos0 = cell_to_position(grid_cell_size, cell0)
-    pos1 = cell_to_position(grid_cell_size, cell1)
-    return euclidean_2d_distance_squared(pos0, pos1)
-
-def euclidean_2d_distance_squared(pos0, pos1):
-    x0,y0 = pos0
-    x1,y1 = pos1
-    dx = x1 - x0
-    dy = y1 - y0
-    return dx*dx+dy*dy
-
-def position_to_cell(grid_cell_size, position):
-    px, py = position[0] - 2, position[1] - 2
-    cw, ch = grid_cell_size
-    cx, cy = int(px / cw) + 11, int(py / ch) + 11
-    return (cx, cy)
-
-def cell_to_position(grid_cell_size, cell):
-    cx, cy = cell
-    cx -= 11
-    cy -= 11
-    cw, ch = grid_cell_size
-    return (cx * cw + 2, cy * ch + 2)
-
-def current_cell(movable):
-    return position_to_cell(movable.cfg.grid_cell_size, movable.position)
-
-def cell_center(grid_cell_size, cell):
-    cx,cy = cell_to_position(grid_cell_size, cell)
-    cx += grid_cell_size[0] / 2
-    cy += grid_cell_size[1] / 2
-    return (cx, cy)
-
 class SoundRepeated:
     """ Allows creating a sound that is being constantly being played
     in a loop if you keep calling play method. If you don't call play
-    mehod for 'cooldown' seconds then the sound is stopped
-
-    Remember to call update in main loop
+    mehod for 'cooldown' seconds then the sound is stopped (by an event
+    of the AudioEngine, see PacmanGame.process_event)
     """
     def __init__(self, name, res, cooldown = None):
         """
@@ -64,28 +42,12 @@ class SoundRepeated:
         self.res = res
         self.name = name
         self.cooldown = cooldown
-        self.timer = 0
-        self.channel = None
 
     def play(self):
-        if self.timer == 0:
-            self.channel = self.res.sounds_play(self.name, -1)
-        self.timer = self.cooldown
+        self.res.sounds_loop(self.name, self.cooldown)
 
     def stop(self):
-        if self.channel == None:
-            return
-        self.timer = 0
-        self.channel.stop()
-        self.channel = None
-
-    def update(self, dt):
-        if self.timer == None:
-            return
-        if self.timer != 0:
-            self.timer -= dt
-        if self.timer < 0:
-            self.stop()
+        self.res.sounds_stop_loop(self.name)
 
 class Ghost:
     def __init__(self, cfg, position, direction, color, res, pacmans, ghosts, random, game):
@@ -101,6 +63,7 @@ class Ghost:
         self.frightened = False
         self.random = random
         self.game = game
+        self.level = game.level
         self.isdead = False # if the ghost is dead he is show as eyes,
                             # he is not colliding with anything and he
                             # returns straight to home
@@ -119,9 +82,11 @@ class Ghost:
 
         self.prev_cell = position_to_cell(self.cfg.grid_cell_size, self.position)
         self.curr_cell = self.prev_cell
+        self.previous_position = self.position # at the start of the tick (see PacmanGame.interpolate)
 
-    def set_board(self, board):
-        self.board = board
+    def set_maze(self, maze, maze_index):
+        self.maze = maze
+        self.maze_index = maze_index
 
     def start(self):
         if self.state == GHOST_STATE_STOPPED:
@@ -155,16 +120,15 @@ class Ghost:
         npx, npy = px + dx * dt * speed, py + dy * dt * speed
 
         # tunnel
-        if npx > 248:
-            npx = -4
-        if npx < -4:
-            npx = 248
+        npx = self.level.wrap(npx)
 
         # update the position and current sprite
         self.position = npx, npy
-        self.sprite[self.__current_sprite_id()].update(dt)
+        self.sprite[self.sprite_id()].update(dt)
 
-    def __current_sprite_id(self):
+    def sprite_id(self):
+        """ Index of the sprite (GHOST_SPRITE_* or direction) shown now
+        """
         if self.isdead:
             return GHOST_SPRITE_EYES + self.direction
         elif self.frightened:
@@ -183,9 +147,10 @@ class Ghost:
         if self.color == 'red':
             self.state = GHOST_STATE_CHASE
         x, y = self.position
-        if self.direction == DIR_UP and y <= 108:
+        top, bottom = self.level.prison
+        if self.direction == DIR_UP and y <= top:
             self.direction = DIR_DOWN
-        elif self.direction == DIR_DOWN and y > 113:
+        elif self.direction == DIR_DOWN and y > bottom:
             self.direction = DIR_UP
 
     def __update_leave_prison(self, dt):
@@ -198,12 +163,13 @@ class Ghost:
         if self.color == 'teal':        # teal should choose right as he is on the left
             self.direction = DIR_RIGHT
 
+        door_x, door_y = self.level.door
         x, y = self.position            # if ghost reached center - make him go up
-        if x < 120 and x > 118:
+        if abs(x - door_x) < 1:
             self.direction = DIR_UP
-            self.target = (27,22)
+            self.target = self.level.home
 
-        if y < 90:                      # if ghost reached entrance - go to chase state
+        if y < door_y:                  # if ghost reached entrance - go to chase state
             self.direction = DIR_LEFT
             self.state = GHOST_STATE_CHASE
 
@@ -225,7 +191,7 @@ class Ghost:
         Target cell depends on ghost color and current state of the
         ghost
         """
-        if self.isdead and self.curr_cell == (27,22):
+        if self.isdead and self.curr_cell == self.level.home:
             self.isdead = False
 
         # center of current cell
@@ -250,7 +216,7 @@ class Ghost:
             self.position = cx,cy # align ghost to the center of the cell
             # choose next target cell
             if self.isdead:
-                self.target = (27,22)
+                self.target = self.level.home
             elif self.frightened:
                 self.target = self.__frightened_target()
             else:
@@ -265,31 +231,39 @@ class Ghost:
             self.__pursue_target(dt)
 
     def __pursue_target(self, dt):
-        # compute next cell in current direction
-        cell = self.__get_cell_in_direction(current_cell(self), self.direction)
-        # check all possible directions from cx,cy - choose the
-        # one that is closest to the target (according to
-        # euclidean norm)
-        distance = cells_euclidean_2d_distance_squared
+        # check all possible directions from the next cell in current
+        # direction - choose the one that is closest to the target
+        # (according to euclidean norm or, with "maze" targeting, path
+        # length through the maze and euclidean norm on ties)
+        exits = self.maze_index.exits(current_cell(self), self.direction)
+        tx, ty = cell_to_position(self.cfg.grid_cell_size, self.target)
+        path_lengths = None
+        if self.cfg.ghost_targeting == "maze":
+            path_lengths = self.game.distance_tables.to_target(self.target)
+            width = self.maze.width
         best_cell_distance = 999999 # infinity
+        best_path_length = UNREACHABLE
         for direction in [DIR_UP, DIR_LEFT, DIR_DOWN, DIR_RIGHT]:
-            direction_cxy = self.__get_cell_in_direction(cell, direction)
-            # can't reverse direction
-            if (4 + direction - self.direction) % 4 == 2:
-                continue
-            # position in the direction must be valid
-            if self.board.get_at(direction_cxy)[1] != 255:
+            # direction must be valid and can't reverse direction
+            exit = exits[direction]
+            if exit is None:
                 continue
             # position in the direction must be closest to target
-            d = distance(self.cfg.grid_cell_size, direction_cxy, self.target)
+            px, py = exit[1]
+            dx, dy = tx - px, ty - py
+            d = dx*dx + dy*dy
+            if path_lengths is not None:
+                (cx, cy) = exit[0]
+                path_length = path_lengths[cy * width + cx]
+                if path_length > best_path_length:
+                    continue
+                if path_length < best_path_length:
+                    best_path_length = path_length
+                    best_cell_distance = 999999
             if d < best_cell_distance:
                 best_cell_distance = d
                 self.next_direction = direction
 
-    def __get_cell_in_direction(self, (cell_x, cell_y), direction):
-        dx, dy = direction_to_vector(direction)
-        return (cell_x + dx, cell_y + dy)
-
     def scatter(self):
         """Switch ghost to scatter state"""
         if self.state == GHOST_STATE_CHASE:
@@ -313,23 +287,18 @@ class Ghost:
         nonempty cell nor you can reverse direction """
         directions_to_try = range(self.random.integer(DIR_LEFT, DIR_UP), DIR_STOP)
         directions_to_try.extend([DIR_LEFT, DIR_DOWN, DIR_RIGHT, DIR_UP]) # all directions must be on list
-        cell = self.__get_cell_in_direction(current_cell(self), self.direction)
+        exits = self.maze_index.exits(current_cell(self), self.direction)
         for direction in directions_to_try:
-            direction_cxy = self.__get_cell_in_direction(cell, direction)
-            # can't reverse direction
-            if (4 + direction - self.direction) % 4 == 2:
-                continue
-            # position in the direction must be valid
-            if self.board.get_at(direction_cxy)[1] != 255:
-                continue
-            return direction_cxy # get first that matches requirements
+            # direction must be valid and can't reverse direction
+            if exits[direction] is not None:
+                return exits[direction][0] # get first that matches requirements
         return self.target # in case that all directions are invalid
 
     def __red_target(self):
         """ Closest pacman's cell
         """
         if self.state == GHOST_STATE_SCATTER:
-            return (41,9)
+            return self.level.scatter["red"]
         else:
             closest_pacman = self.__get_closest_pacman()
             return position_to_cell(self.cfg.grid_cell_size, closest_pacman.position)
@@ -338,7 +307,7 @@ class Ghost:
         """ Four cells in front of pacman
         """
         if self.state == GHOST_STATE_SCATTER:
-            return (13,9)
+            return self.level.scatter["pink"]
         else:
             closest_pacman = self.__get_closest_pacman()
             cx, cy = position_to_cell(self.cfg.grid_cell_size, closest_pacman.position)
@@ -351,7 +320,7 @@ class Ghost:
         cell = P + v
         """
         if self.state == GHOST_STATE_SCATTER:
-            return (42,42)
+            return self.level.scatter["teal"]
         else:
             closest_pacman = self.__get_closest_pacman()
             px, py = position_to_cell(self.cfg.grid_cell_size, closest_pacman.position)
@@ -367,7 +336,7 @@ class Ghost:
         point (bottom left corner)
         """
         if self.state == GHOST_STATE_SCATTER:
-            return (12,42)
+            return self.level.scatter["orange"]
         else:
             cell = position_to_cell(self.cfg.grid_cell_size, self.position)
             closest_pacman = self.__get_closest_pacman()
@@ -376,33 +345,39 @@ class Ghost:
             if euclidean_2d_distance_squared(pacman_cell, cell) >= 64: # sqrt(x) < 8
                 return pacman_cell
             else:
-                return (12,42)
+                return self.level.scatter["orange"]
 
     def __get_closest_pacman(self):
+        """ The first pacman (even if he is dead) unless a living pacman
+        is closer. The living pacmans are looked up in the game's
+        occupancy index
+        """
         closest_pacman = self.pacmans[0]
-        closest_distance = euclidean_2d_distance_squared(self.position, closest_pacman.position)
-        for pacman in self.pacmans:
-            if not pacman.is_alive():
-                continue
-            distance = euclidean_2d_distance_squared(self.position, pacman.position)
-            if distance < closest_distance:
-                closest_distance = distance
+        i = self.game.pacman_cells.nearest(self.position)
+        if i is not None and i != 0:
+            pacman = self.pacmans[i]
+            if (euclidean_2d_distance_squared(self.position, pacman.position) <
+                euclidean_2d_distance_squared(self.position, closest_pacman.position)):
                 closest_pacman = pacman
         return closest_pacman
 
-    def display(self, screen):
-        self.sprite[self.__current_sprite_id()].display(screen, self.position)
+    def rect(self, alpha = 1):
+        return self.sprite[self.sprite_id()].rect(interpolate(self.previous_position, self.position, alpha))
+
+    def display(self, screen, alpha = 1):
+        self.sprite[self.sprite_id()].display(screen, interpolate(self.previous_position, self.position, alpha))
         px, py = cell_to_position(self.cfg.grid_cell_size, self.target)
 
         if self.cfg.display_position:
-            pygame.draw.rect(screen, color.by_name[self.color], (px-1, py-1, 10,10))
+            pygame.draw.rect(screen, color.by_name[self.color], scaled(self.res.scale, (px-1, py-1, 10,10)))
 
 class Pacman:
-    def __init__(self, cfg, direction, color, res):
+    def __init__(self, cfg, direction, color, res, level):
         self.cfg = cfg
         self.direction = direction
         self.color = color
         self.res = res
+        self.level = level
         self.points = 0
         self.lives = 3
 
@@ -412,16 +387,19 @@ class Pacman:
                         Sprite("pacman-up-"+color,    self.res, 0.03),
                         Sprite("pacman-stop-"+color,  self.res, 0.03) ]
 
+        self.next_direction = DIR_STOP
+        self.controller = None # decides next_direction instead of the keyboard (see autopilot.py)
         self.reset()
+        self.previous_position = self.position # at the start of the tick (see PacmanGame.interpolate)
         self.speed = self.cfg.packman_standard_speed
 
-    def set_board(self, board):
-        self.board = board
+    def set_maze(self, maze):
+        self.maze = maze
 
     def reset(self):
         """ Reset pacman state when the level is changed or pacman is killed
         """
-        self.position = self.cfg.pacman_position[self.color]
+        self.position = self.level.pacman_start[self.color]
         self.direction = DIR_STOP
         for sprite in self.sprite:
             sprite.reset_animation()
@@ -454,21 +432,21 @@ class Pacman:
                 npy -= 1
 
         # tunnel
-        if npx > 248:
-            npx = -4
-        if npx < -4:
-            npx = 248
+        npx = self.level.wrap(npx)
 
         # update position if you can enter new cell
         cx, cy = position_to_cell(self.cfg.grid_cell_size, (npx, npy))
-        if self.board.get_at((cx, cy))[1] == 255: # if the field is green
+        if self.maze.is_walkable((cx, cy)):
             self.position = npx, npy
 
         # update animation
         self.sprite[self.direction].update(dt)
 
-    def display(self, screen):
-        self.sprite[self.direction].display(screen, self.position)
+    def rect(self, alpha = 1):
+        return self.sprite[self.direction].rect(interpolate(self.previous_position, self.position, alpha))
+
+    def display(self, screen, alpha = 1):
+        self.sprite[self.direction].display(screen, interpolate(self.previous_position, self.position, alpha))
 
 class PacmanGame(GameState):
     def __init__(self, cfg, res):
@@ -484,9 +462,28 @@ class PacmanGame(GameState):
             "green"  : Sprite("life-green", self.res)
             }
         self.dot     = Sprite("dot", self.res)
-        self.level   = Sprite("level", self.res, None, ORIGIN_TOP_LEFT)
+        self.level   = load_level(self.cfg.level_path, self.cfg.level_cache_path())
+        self.level_sprite = Sprite(self.level.background, self.res, None, ORIGIN_TOP_LEFT)
         self.powerup = Sprite("powerup", self.res, 0.5)
         self.hud     = Sprite("hud", self.res, None, ORIGIN_TOP_LEFT)
+        self.level_maze = self.level.maze
+        self.maze_index = MazeIndex(self.level_maze, self.cfg.grid_cell_size)
+        self.maze_arrays = None # built when needed by GhostBatch
+        self.distance_tables = DistanceTables(self.level) # shortest paths, filled when needed
+        self.dot_layer = DotLayer(self.cfg, self.level_sprite, self.dot, self.powerup)
+        self.hud_layer = HudLayer(self.res, self.hud, self.life_sprite)
+        self.render_queue = RenderQueue()
+        # cells of living pacmans and of ghosts, updated every tick
+        self.pacman_cells = CellOccupancy(self.cfg.grid_cell_size)
+        self.ghost_cells = None
+        self.full_redraw = True
+        self.sprite_rects = []
+        self.hud_dirty = True
+        self.saved_state = None # snapshot of the game (keys 7 and 8)
+        self.alpha = 1 # sprites are shown between the last two ticks (see interpolate)
+        self.stream = None # SpectatorStream that gets every tick
+        self.controlled = False # control was done for the coming update
+        self.games = 0 # games finished before this one (see restart)
 
         self.sound_siren = SoundRepeated("siren", self.res)
         self.sound_waka = SoundRepeated("waka", self.res, 0.5)
@@ -498,7 +495,20 @@ class PacmanGame(GameState):
         care of initial state of the game, starts first level
         """
         self.__set_pacmans()
-        self.set_level(1)
+        self.dots_eaten = 0 # during the whole game
+        self.set_level(self.cfg.start_level)
+
+    def restart(self):
+        """ Start a new game with as many pacmans as the last one had.
+        The autopilot does it when all pacmans are dead
+        """
+        players = len(self.pacman)
+        self.games += 1
+        self.__set_pacmans()
+        self.dots_eaten = 0
+        self.set_level(self.cfg.start_level)
+        if players > 1:
+            self.add_green_pacman()
 
     def kill_pacman(self, pacman):
         """ Called when a pacman die.
@@ -520,15 +530,17 @@ class PacmanGame(GameState):
         else:
             self.res.sounds_play("intermission")
 
-        self.board = self.res.animation["board"][0].copy()
+        self.maze = self.level_maze.copy()
+        self.dot_layer.render(self.maze)
+        self.full_redraw = True
         self.phase_num = 0
         self.level_num = level_num
         self.__reset_level_state()
         for pacman in self.pacman:
             if not pacman.is_alive():
                 continue
-            pacman.set_board(self.board)
-        self.dots_left = self.cfg.dots_to_eat
+            pacman.set_maze(self.maze)
+        self.dots_left = self.level.dots_to_eat
 
     def go_to_next_level(self):
         self.set_level(self.level_num+1)
@@ -539,7 +551,7 @@ class PacmanGame(GameState):
         self.frighten_mode = False
         self.frightened_timer = 0
         self.game_started = False
-        self.random = Random(13)
+        self.random = Random(self.cfg.random_seed)
         self.__set_ghosts()
         for pacman in self.pacman:
             if not pacman.is_alive():
@@ -550,16 +562,31 @@ class PacmanGame(GameState):
 
     def __set_pacmans(self):
         self.pacman = []
-        self.pacman.append(Pacman(self.cfg, DIR_STOP, "yellow", self.res))
+        self.pacman.append(Pacman(self.cfg, DIR_STOP, "yellow", self.res, self.level))
+        self.__attach_autopilot(self.pacman[0])
+
+    def __attach_autopilot(self, pacman):
+        if self.cfg.autopilot:
+            pacman.controller = AutopilotController(self.level, self.distance_tables, self.cfg)
 
     def __set_ghosts(self):
+        if self.cfg.ghost_engine == "numpy":
+            self.ghost_batch = GhostBatch(self.cfg, self.res, self.pacman, self.random, self, self.cfg.ghost_count)
+            if self.maze_arrays is None:
+                self.maze_arrays = MazeIndexArrays(self.maze_index)
+            self.ghost_batch.set_maze(self.maze, self.maze_index, self.maze_arrays)
+            self.ghost = self.ghost_batch.ghosts
+            return
+        self.ghost_batch = None
         self.ghost = []
-        self.ghost.append(Ghost(self.cfg, self.cfg.ghost_red_position, DIR_LEFT, "red", self.res, self.pacman, self.ghost, self.random, self))
-        self.ghost.append(Ghost(self.cfg, self.cfg.ghost_teal_position, DIR_UP, "teal", self.res, self.pacman, self.ghost, self.random, self))
-        self.ghost.append(Ghost(self.cfg, self.cfg.ghost_pink_position, DIR_UP, "pink", self.res, self.pacman, self.ghost, self.random, self))
-        self.ghost.append(Ghost(self.cfg, self.cfg.ghost_orange_position, DIR_UP, "orange", self.res, self.pacman, self.ghost, self.random, self))
+        for i in range(self.cfg.ghost_count):
+            color, position, direction = self.level.ghost_setup(i)
+            self.ghost.append(Ghost(self.cfg, position, direction, color, self.res, self.pacman, self.ghost, self.random, self))
         for ghost in self.ghost:
-            ghost.set_board(self.board)
+            ghost.set_maze(self.maze, self.maze_index)
+        # new index - the old one may be still used by __ghosts_colliding
+        self.ghost_cells = CellOccupancy(self.cfg.grid_cell_size)
+        self.ghost_cells.update([ghost.position for ghost in self.ghost])
 
     def __change_phase(self):
         """Change phase scatter->chase, chase->scatter, none->scatter
@@ -584,17 +611,52 @@ class PacmanGame(GameState):
 
     def add_green_pacman(self):
         if len(self.pacman) < 2:
-            self.pacman.append(Pacman(self.cfg, DIR_STOP, "green", self.res))
+            self.pacman.append(Pacman(self.cfg, DIR_STOP, "green", self.res, self.level))
+            self.__attach_autopilot(self.pacman[1])
             self.pacman[1].reset()
-            self.pacman[1].set_board(self.board)
+            self.pacman[1].set_maze(self.maze)
+
+    def control(self):
+        """ Let controllers of pacmans decide where they go. It is done
+        at the start of every update. States recording inputs call it
+        before they record - then it is not done again in the update.
+        With --autopilot a new game starts when all pacmans are dead
+        """
+        if self.controlled:
+            return
+        self.controlled = True
+        if self.cfg.autopilot and self.is_game_over():
+            self.restart()
+        controlled = False
+        for pacman in self.pacman:
+            if pacman.controller is None or not pacman.is_alive():
+                continue
+            controlled = True
+            direction = pacman.controller.decide(self, pacman)
+            if direction is not None:
+                pacman.next_direction = direction
+        if controlled:
+            self.start_game() # nobody would press a key
 
     def update(self, dt):
+        self.control()
+        self.controlled = False
+        for pacman in self.pacman:
+            pacman.previous_position = pacman.position
+        if self.ghost_batch:
+            self.ghost_batch.remember_positions()
+        else:
+            for ghost in self.ghost:
+                ghost.previous_position = ghost.position
+        self.__update(dt)
+        if self.stream:
+            self.stream.tick(self, dt)
+
+    def __update(self, dt):
         if not self.game_started:
             return
 
         self.sound_siren.play()
-        self.sound_siren.update(dt)
-        self.sound_waka.update(dt)
 
         if self.frighten_mode:
             self.frightened_timer -= dt
@@ -611,26 +673,33 @@ class PacmanGame(GameState):
             if not pacman.is_alive():
                 continue
             pacman.update(dt)
+        self.pacman_cells.update([pacman.position if pacman.is_alive() else None
+                                  for pacman in self.pacman])
 
-        for ghost in self.ghost:
-            ghost.update(dt)
+        if self.ghost_batch:
+            self.ghost_batch.update(dt)
+        else:
+            for ghost in self.ghost:
+                ghost.update(dt)
+            self.ghost_cells.update([ghost.position for ghost in self.ghost])
 
         # check collision with dots
         for pacman in self.pacman:
             if not pacman.is_alive():
                 continue
-            cx, cy = position_to_cell(self.cfg.grid_cell_size, pacman.position)
-            r,g,b,a = self.board.get_at((cx,cy))
-            if r == 255 and b == 255: # energizer
+            cell = position_to_cell(self.cfg.grid_cell_size, pacman.position)
+            eaten = self.maze.eat(cell)
+            if eaten:
+                self.dot_layer.eat(cell, eaten)
+            if eaten == CELL_ENERGIZER:
                 self.res.sounds_play("powerup")
                 pacman.points += 50
-                self.board.set_at((cx,cy),(0,255,0,1))
                 self.frighten_ghosts()
-            elif r == 255: # small dot
+            elif eaten == CELL_DOT:
                 self.sound_waka.play()
                 pacman.points += 10
-                self.board.set_at((cx,cy),(0,255,0,1))
                 self.dots_left -= 1
+                self.dots_eaten += 1
                 if self.dots_left <= 0:
                     self.go_to_next_level()
                     return
@@ -639,8 +708,8 @@ class PacmanGame(GameState):
         for pacman in self.pacman:
             if not pacman.is_alive():
                 continue
-            for ghost in self.ghost:
-                if not ghost.isdead and current_cell(pacman) == current_cell(ghost):
+            for ghost in self.__ghosts_colliding(pacman):
+                if not ghost.isdead:
                     if self.frighten_mode: # ghost is eaten by the pacman
                         pacman.points += 1000
                         ghost.isdead = True
@@ -648,104 +717,145 @@ class PacmanGame(GameState):
                     else: # pacman is killed by the ghost
                         self.kill_pacman(pacman)
 
+    def __ghosts_colliding(self, pacman):
+        """ Generates ghosts that are in the same cell as the pacman
+
+        Pacman's cell is checked again for every ghost, because he is
+        moved when he is killed. The ghosts are replaced then, but the
+        check goes on with the ghosts of this tick
+        """
+        ghosts = self.ghost
+        index = self.ghost_batch or self.ghost_cells
+        first = 0
+        while True:
+            hits = index.in_cell(current_cell(pacman), first)
+            if len(hits) == 0:
+                return
+            yield ghosts[hits[0]]
+            first = hits[0] + 1
+
     def display(self, screen):
-        self.level.display(screen, (0,0))
-        bw, bh = self.cfg.board_size
-
-        gw,gh = self.cfg.grid_size
-        for cy in range(0,gh):
-            for cx in range(0,gw):
-                r,g,b,a = self.board.get_at((cx,cy))
-                px, py = cell_to_position(self.cfg.grid_cell_size, (cx, cy))
-                if b == 255: # power-up
-                    self.powerup.display(screen, (px + 4, py + 4))
-                elif r == 255: # dot
-                    self.dot.display(screen, (px + 4, py + 4))
+        # debug views draw directly onto the screen, between the sprites
+        debug = self.cfg.display_grid or self.cfg.display_position
+        canvas = screen if debug else self.render_queue
+        self.dot_layer.display(canvas)
+        self.dot_layer.display_energizers(canvas)
 
         for ghost in self.ghost:
-            ghost.display(screen)
+            ghost.display(canvas, self.alpha)
 
+        s = self.res.scale
         if self.cfg.display_grid:
-            gw,gh = self.cfg.grid_size
+            gw,gh = self.maze.size()
             for cy in range(0,gh):
                 for cx in range(0,gw):
-                    px, py = cell_to_position(self.cfg.grid_cell_size, (cx, cy))
-                    pygame.draw.line(screen, (255,0,0), (0,py), (self.cfg.resolution[0], py))
-                    pygame.draw.line(screen, (255,0,0), (px,0), (px,self.cfg.resolution[1]))
+                    px, py = scaled(s, cell_to_position(self.cfg.grid_cell_size, (cx, cy)))
+                    pygame.draw.line(screen, (255,0,0), (0,py), (self.cfg.resolution[0] * s, py))
+                    pygame.draw.line(screen, (255,0,0), (px,0), (px,self.cfg.resolution[1] * s))
 
         for pacman in self.pacman:
             if not pacman.is_alive():
                 continue
-            pacman.display(screen)
+            pacman.display(canvas, self.alpha)
 
-        self.hud.display(screen, (bw,0))
-
-        if not self.game_started:
-            text_ready = self.res.font_render("LESSERCO", 16, "READY!", (255,255,0))
-            screen.blit(text_ready, (100,125))
-
-        text_level = self.res.font_render("LESSERCO", 24, "LEVEL:", (255,0,0))
-        text_level_num = self.res.font_render("LESSERCO", 24, str(self.level_num), (255,255,0))
-        screen.blit(text_level, (bw+10, 10))
-        screen.blit(text_level_num, (bw+10, 30))
-
-        text_points = self.res.font_render("LESSERCO", 24, "POINTS:", (255,0,0))
-        screen.blit(text_points, (bw+10, 50))
-        pos_y = 70
-        for pacman in self.pacman:
-            if not pacman.is_alive():
-                continue
-            text_points = self.res.font_render("LESSERCO", 24, str(pacman.points), color.by_name[pacman.color])
-            screen.blit(text_points, (bw+10, pos_y))
-            pos_y += 20
-
-        text_lives = self.res.font_render("LESSERCO", 24, "LIVES:", color.by_name["red"])
-        screen.blit(text_lives, (bw+10, pos_y))
-        pos_y += 10+20
-        for pacman in self.pacman:
-            if not pacman.is_alive():
-                continue
-            pos_x = bw+10
-            for life in range(pacman.lives):
-                self.life_sprite[pacman.color].display(screen, (pos_x, pos_y))
-                pos_x += 12
-            pos_y += 20
-
-        if self.frighten_mode:
-            text_frighten_mode = self.res.font_render("LESSERCO", 24, "FRIGHTEN", (255,0,0))
-            text_frighten_timer = self.res.font_render("LESSERCO", 24, str(self.frightened_timer), (255,0,0))
-            screen.blit(text_frighten_mode, (bw+10, 140))
-            screen.blit(text_frighten_timer, (bw+10, 160))
-
-        text_phase = self.res.font_render("LESSERCO", 24, "Phase:", (255,0,0))
-        phase_name = ""
-        if self.phase == GAME_PHASE_SCATTER:
-            phase_name = "scatter"
-        elif self.phase == GAME_PHASE_CHASE:
-            phase_name = "chase"
-        text_phase_name = self.res.font_render("LESSERCO", 24, phase_name, (255,0,0))
-        text_phase_timer = self.res.font_render("LESSERCO", 24, str(self.phase_timer), (255,0,0))
-        screen.blit(text_phase, (bw+10,180))
-        screen.blit(text_phase_name, (bw+10, 200))
-        screen.blit(text_phase_timer, (bw+10, 220))
+        self.__display_ready(canvas)
+        self.__display_hud(canvas)
+        if not debug:
+            self.render_queue.flush(screen)
 
         if self.cfg.display_position:
             for ghost in self.ghost:
                 text = self.res.font_render("LESSERCO", 14, str(ghost.curr_cell), color.by_name[ghost.color])
-                screen.blit(text, ghost.position)
+                screen.blit(text, scaled(s, ghost.position))
                 cx,cy = cell_to_position(self.cfg.grid_cell_size, ghost.curr_cell)
-                pygame.draw.rect(screen, (0,0,255), (cx,cy,8,8),1)
+                pygame.draw.rect(screen, (0,0,255), scaled(s, (cx,cy,8,8)),1)
                 px,py = ghost.position
-                pygame.draw.rect(screen, (0,255,0), (px, py, 1, 1), 1)
+                pygame.draw.rect(screen, (0,255,0), scaled(s, (px, py, 1, 1)), 1)
 
                 for pacman in self.pacman:
                     cell = position_to_cell(self.cfg.grid_cell_size, pacman.position)
                     text = self.res.font_render("LESSERCO", 14, str(cell), color.by_name[pacman.color])
                     cx,cy = cell_to_position(self.cfg.grid_cell_size, cell)
                     px,py = pacman.position
-                    screen.blit(text, pacman.position)
-                    pygame.draw.rect(screen, (0,0,255), (cx,cy,8,8),1)
-                    pygame.draw.rect(screen, (0,255,0), (px, py, 1, 1), 1)
+                    screen.blit(text, scaled(s, pacman.position))
+                    pygame.draw.rect(screen, (0,0,255), scaled(s, (cx,cy,8,8)),1)
+                    pygame.draw.rect(screen, (0,255,0), scaled(s, (px, py, 1, 1)), 1)
+
+        self.sprite_rects = self.__sprite_rects()
+        self.full_redraw = False
+
+    def interpolate(self, alpha):
+        """ Show sprites alpha (0 to 1) of the way from their position
+        at the start of the last tick to the current one
+        """
+        if self.cfg.interpolation:
+            self.alpha = alpha
+
+    def background(self):
+        return self.dot_layer.surface
+
+    def dirty_rects(self):
+        """ Rects changed since the last frame (None if everything changed)
+
+        Contains old and new bounds of all sprites, eaten dots and the
+        HUD panel if any of its values changed
+        """
+        if self.full_redraw or self.cfg.display_grid or self.cfg.display_position:
+            return None
+        rects = self.dot_layer.flush()
+        sprite_rects = self.__sprite_rects()
+        rects.extend(self.sprite_rects)
+        rects.extend(sprite_rects)
+        self.sprite_rects = sprite_rects
+
+        hud_rect = self.hud_layer.rect((self.cfg.board_size[0], 0))
+        hud_changed = self.hud_layer.update(hud_items(self))
+        self.hud_dirty = hud_changed or hud_rect.collidelist(rects) != -1
+        if self.hud_dirty:
+            rects.append(hud_rect)
+        return rects
+
+    def display_foreground(self, screen):
+        """ Draw everything that is not a part of background()
+
+        Used in dirty rects mode after the background of dirty_rects()
+        is restored
+        """
+        queue = self.render_queue
+        self.dot_layer.display_energizers(queue)
+        for ghost in self.ghost:
+            ghost.display(queue, self.alpha)
+        for pacman in self.pacman:
+            if not pacman.is_alive():
+                continue
+            pacman.display(queue, self.alpha)
+        self.__display_ready(queue)
+        if self.hud_dirty:
+            self.__display_hud(queue)
+        queue.flush(screen)
+
+    def __sprite_rects(self):
+        rects = self.dot_layer.energizer_rects()
+        for ghost in self.ghost:
+            rects.append(ghost.rect(self.alpha))
+        for pacman in self.pacman:
+            if not pacman.is_alive():
+                continue
+            rects.append(pacman.rect(self.alpha))
+        if not self.game_started:
+            w, h = self.res.font["LESSERCO"][16].size("READY!")
+            x, y = scaled(self.res.scale, (100, 125))
+            rects.append(pygame.Rect(x, y, w, h))
+        return rects
+
+    def __display_ready(self, screen):
+        if not self.game_started:
+            text_ready = self.res.font_render("LESSERCO", 16, "READY!", (255,255,0))
+            screen.blit(text_ready, scaled(self.res.scale, (100,125)))
+
+    def __display_hud(self, screen):
+        self.hud_layer.update(hud_items(self))
+        self.hud_layer.display(screen, (self.cfg.board_size[0], 0))
 
     def frighten_ghosts(self):
         self.frighten_mode = True
@@ -759,19 +869,38 @@ class PacmanGame(GameState):
         for ghost in self.ghost:
             ghost.unfrighten()
 
-    def __start_game(self):
+    def is_game_over(self):
+        for pacman in self.pacman:
+            if pacman.is_alive():
+                return False
+        return True
+
+    def start_game(self):
         if not self.game_started:
             self.game_started = True
             for ghost in self.ghost:
                 ghost.start()
 
+    def finish(self):
+        if self.stream:
+            self.stream.close()
+        if self.cfg.autopilot:
+            print "autopilot: %d games finished, level %d, points %s" % (
+                self.games, self.level_num, [pacman.points for pacman in self.pacman])
+        if self.cfg.audio_stats:
+            self.res.audio.report()
+
     def process_event(self, event):
         if event.type == QUIT:
+            self.finish()
             sys.exit()
+        if event.type in LOOP_EVENTS:
+            self.res.audio.process_event(event)
         if event.type == KEYDOWN:
             if event.key != K_0:
-                self.__start_game()
+                self.start_game()
             if event.key == K_ESCAPE:
+                self.finish()
                 sys.exit()
             elif event.key == K_LEFT:
                 self.pacman[0].next_direction = DIR_LEFT
@@ -796,8 +925,17 @@ class PacmanGame(GameState):
                         break;
             elif event.key == K_2:
                 self.cfg.display_position = not self.cfg.display_position
+                self.full_redraw = True
             elif event.key == K_3:
                 self.cfg.display_grid = not self.cfg.display_grid
+                self.full_redraw = True
+            elif event.key == K_6:
+                self.cfg.display_frame_stats = not self.cfg.display_frame_stats
+            elif event.key == K_7:
+                self.saved_state = snapshot(self)
+            elif event.key == K_8:
+                if self.saved_state:
+                    restore(self, self.saved_state)
             elif event.key == K_4:
                 for ghost in self.ghost:
                     if ghost.state == GHOST_STATE_CHASE:
@@ -816,10 +954,34 @@ class PacmanGame(GameState):
 
 def main():
     cfg = Config()
+    if cfg.replay_path:
+        cfg.autopilot = False # decisions of the autopilot are in the log
+    if cfg.replay_path and not cfg.render:
+        headless = replay_headless(cfg.replay_path, cfg)
+        print "ticks: %d, time: %.2fs, level: %d, points: %s" % (
+            headless.ticks, headless.elapsed, headless.game.level_num,
+            [pacman.points for pacman in headless.game.pacman])
+        return
     fsm = GameFsm(cfg)
     res = Resources(cfg)
     res.load_all()
-    fsm.set_state(PacmanGame(cfg, res))
+    if cfg.startup_trace:
+        print res.load_report()
+    if cfg.net_connect:
+        state = ClientState(cfg, res, cfg.net_connect)
+    elif cfg.watch:
+        state = SpectatorState(cfg, res, cfg.watch, cfg.replay_speed)
+    else:
+        state = PacmanGame(cfg, res)
+        if cfg.stream_path or cfg.stream_port:
+            state.stream = SpectatorStream(cfg.stream_path, cfg.stream_port and int(cfg.stream_port))
+        if cfg.net_host_port:
+            state = HostState(state, int(cfg.net_host_port))
+        elif cfg.replay_path:
+            state = ReplayState(state, cfg.replay_path, cfg.replay_speed)
+        elif cfg.record_path:
+            state = RecordingState(state, Recorder(cfg.record_path))
+    fsm.set_state(state)
     pygame.display.set_caption("Pacman4two")
     pygame.mouse.set_visible(not cfg.fullscreen)
     fsm.run()
@@ -0,0 +1,94 @@
+""" Compact representation of the maze
+
+The maze is a bytearray of cell flags (CELL_* from const), one byte
+per cell row by row. Levels (see level.py) define the mazes.
+"""
+
+from const import *
+from utils import *
+
+class Maze:
+    def __init__(self, size, cells = None):
+        """
+        size  (width, height) of the maze in cells
+        cells bytearray with flags of every cell (row by row). If
+              None then the maze is filled with walls
+        """
+        self.width, self.height = size
+        if cells is None:
+            cells = bytearray(self.width * self.height)
+        self.cells = cells
+
+    def copy(self):
+        return Maze((self.width, self.height), bytearray(self.cells))
+
+    def size(self):
+        return self.width, self.height
+
+    def flags(self, cell):
+        return self.cells[cell[1] * self.width + cell[0]]
+
+    def is_walkable(self, cell):
+        return self.cells[cell[1] * self.width + cell[0]] & CELL_WALKABLE
+
+    def has_dot(self, cell):
+        return self.cells[cell[1] * self.width + cell[0]] & CELL_DOT
+
+    def has_energizer(self, cell):
+        return self.cells[cell[1] * self.width + cell[0]] & CELL_ENERGIZER
+
+    def eat(self, cell):
+        """ Remove dot or energizer from the cell
+
+        Returns flags of what was eaten (CELL_DOT, CELL_ENERGIZER or 0)
+        """
+        i = cell[1] * self.width + cell[0]
+        eaten = self.cells[i] & (CELL_DOT | CELL_ENERGIZER)
+        if eaten:
+            self.cells[i] &= ~(CELL_DOT | CELL_ENERGIZER) & 0xff
+        return eaten
+
+    def count(self, flag):
+        """ Number of cells with given flag set
+        """
+        return sum(1 for cell_flags in self.cells if cell_flags & flag)
+
+class MazeIndex:
+    """ Precomputed ghost moves
+
+    Ghost decides where to go in the cell ahead of him. For every cell
+    and heading the index stores exits of the cell ahead: for every
+    direction (DIR_*) the neighbor cell and its position in pixels, or
+    None when the neighbor is a wall or the direction would reverse
+    the ghost. Walls don't change during the game, so the index is
+    built once per maze
+    """
+    def __init__(self, maze, grid_cell_size):
+        self.width, self.height = maze.size()
+        self.table = []
+        vectors = [direction_to_vector(direction) for direction in (DIR_LEFT, DIR_DOWN, DIR_RIGHT, DIR_UP)]
+        for cy in range(self.height):
+            for cx in range(self.width):
+                for heading in (DIR_LEFT, DIR_DOWN, DIR_RIGHT, DIR_UP):
+                    hx, hy = vectors[heading]
+                    ax, ay = cx + hx, cy + hy
+                    exits = []
+                    for direction in (DIR_LEFT, DIR_DOWN, DIR_RIGHT, DIR_UP):
+                        dx, dy = vectors[direction]
+                        cell = ax + dx, ay + dy
+                        if (4 + direction - heading) % 4 == 2 or not self.__is_walkable(maze, cell):
+                            exits.append(None)
+                        else:
+                            exits.append((cell, cell_to_position(grid_cell_size, cell)))
+                    self.table.append(tuple(exits))
+
+    def __is_walkable(self, maze, (cx, cy)):
+        if cx < 0 or cy < 0 or cx >= self.width or cy >= self.height:
+            return False
+        return maze.is_walkable((cx, cy))
+
+    def exits(self, cell, heading):
+        """ Exits of the cell ahead of the ghost in cell going in heading
+        direction
+        """
+        return self.table[(cell[1] * self.width + cell[0]) * 4 + heading]
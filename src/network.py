@@ -0,0 +1,269 @@
+""" Two players over the network
+
+The host runs the game (its player is the yellow pacman) and every tick
+sends a record of state_stream.StateEncoder - only what changed - to
+all connected clients. The first client plays the green pacman: it
+sends direction changes and displays the received records with
+GameView. Other clients only watch.
+
+Sockets are non-blocking and polled once per tick, so the game never
+waits for the network. Messages are framed as:
+
+    byte type (MSG_*), uint16 length of the payload, payload
+
+The host prints every few seconds how many bytes it sends and how much
+time per tick the game update and the networking take.
+
+    python run_game.py --host 5000
+    python run_game.py --connect localhost:5000
+"""
+
+import sys, socket, struct, errno, time
+from pygame.locals import *
+
+from game_fsm import GameState
+from state_stream import StateEncoder, GameView
+from const import *
+
+MSG_STATE = 1 # host -> client: state_stream record
+MSG_INPUT = 2 # client -> host: byte direction of the client's pacman
+MSG_FRAME = 3 # spectator stream: float dt of the tick and record (see spectator.py)
+
+HEADER = struct.Struct("<BH")
+
+def split_messages(data):
+    """ List of (type, payload) of complete messages at the start of
+    data and the rest of data
+    """
+    messages = []
+    pos = 0
+    while len(data) - pos >= HEADER.size:
+        kind, size = HEADER.unpack_from(data, pos)
+        if len(data) - pos - HEADER.size < size:
+            break
+        pos += HEADER.size
+        messages.append((kind, data[pos:pos + size]))
+        pos += size
+    return messages, data[pos:]
+
+def listen(port):
+    """ Non-blocking server socket accepting connections on the port
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("", port))
+    server.listen(4)
+    server.setblocking(0)
+    return server
+
+def accept(server):
+    """ List of (Connection, address) of clients waiting on the server
+    socket
+    """
+    clients = []
+    while True:
+        try:
+            sock, address = server.accept()
+        except socket.error, e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            return clients
+        clients.append((Connection(sock), address))
+
+class Connection:
+    """ Non-blocking TCP connection exchanging framed messages
+    """
+    max_backlog = 256 * 1024 # a client that can't keep up is dropped
+
+    def __init__(self, sock):
+        sock.setblocking(0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.outgoing = ""
+        self.incoming = ""
+        self.closed = False
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send(self, kind, payload):
+        if len(payload) > 0xffff:
+            raise ValueError("message too long (%d bytes)" % len(payload))
+        self.outgoing += HEADER.pack(kind, len(payload)) + payload
+        self.flush()
+        if len(self.outgoing) > self.max_backlog:
+            self.close()
+
+    def flush(self):
+        """ Send as much of the queued data as the socket takes now
+        """
+        while self.outgoing and not self.closed:
+            try:
+                sent = self.sock.send(self.outgoing)
+            except socket.error, e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.close()
+                return
+            self.outgoing = self.outgoing[sent:]
+            self.bytes_sent += sent
+
+    def receive(self):
+        """ List of (type, payload) of messages received completely
+        """
+        while not self.closed:
+            try:
+                data = self.sock.recv(65536)
+            except socket.error, e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.close()
+                break
+            if not data:
+                self.close()
+                break
+            self.incoming += data
+            self.bytes_received += len(data)
+        messages, self.incoming = split_messages(self.incoming)
+        return messages
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
+
+class HostState(GameState):
+    """ Plays the game and sends it to the clients
+    """
+    report_period = 5.0 # seconds between reports of the traffic
+
+    def __init__(self, game, port):
+        self.game = game
+        self.server = listen(port)
+        self.clients = []
+        self.player = None # connection that controls the green pacman
+        self.encoder = StateEncoder()
+        self.__reset_stats()
+
+    def __reset_stats(self):
+        self.stats_ticks = 0
+        self.stats_time = 0
+        self.stats_update = 0
+        self.stats_network = 0
+        self.stats_bytes = 0
+
+    def init(self, screen):
+        self.game.init(screen)
+
+    def update(self, dt):
+        start = time.time()
+        self.__accept()
+        self.__receive_inputs()
+        update_start = time.time()
+        self.game.update(dt)
+        update_end = time.time()
+        if self.clients:
+            record = self.encoder.encode(self.game)
+            for client in self.clients:
+                client.send(MSG_STATE, record)
+                self.stats_bytes += HEADER.size + len(record)
+            self.clients = [client for client in self.clients if not client.closed]
+        end = time.time()
+
+        self.stats_ticks += 1
+        self.stats_time += dt
+        self.stats_update += update_end - update_start
+        self.stats_network += (update_start - start) + (end - update_end)
+        if self.stats_time >= self.report_period:
+            self.report()
+
+    def report(self):
+        if self.stats_ticks == 0:
+            return
+        print "host: %d clients, %.2f kB/s, %.1f B/tick, update %.3f ms/tick, network %.3f ms/tick" % (
+            len(self.clients), self.stats_bytes / 1024.0 / self.stats_time,
+            float(self.stats_bytes) / self.stats_ticks,
+            self.stats_update * 1000 / self.stats_ticks,
+            self.stats_network * 1000 / self.stats_ticks)
+        self.__reset_stats()
+
+    def __accept(self):
+        for connection, address in accept(self.server):
+            self.clients.append(connection)
+            self.encoder.keyframe() # the new client needs the whole state
+            print "host: client %s:%d connected" % address
+
+    def __receive_inputs(self):
+        if self.player is None or self.player.closed:
+            self.player = None
+            for client in self.clients:
+                if not client.closed:
+                    self.player = client
+                    self.game.add_green_pacman()
+                    break
+        for client in self.clients:
+            for kind, payload in client.receive():
+                if kind == MSG_INPUT and client is self.player:
+                    direction, = struct.unpack("<B", payload)
+                    self.game.pacman[1].next_direction = direction
+                    self.game.start_game()
+
+    def process_event(self, event):
+        self.game.process_event(event)
+
+    def display(self, screen):
+        self.game.display(screen)
+
+    def interpolate(self, alpha):
+        self.game.interpolate(alpha)
+
+    def background(self):
+        return self.game.background()
+
+    def dirty_rects(self):
+        return self.game.dirty_rects()
+
+    def display_foreground(self, screen):
+        self.game.display_foreground(screen)
+
+    def finish(self):
+        self.report()
+        for client in self.clients:
+            client.close()
+        self.server.close()
+        self.game.finish()
+
+class ClientState(GameState):
+    """ Shows the game of the host and sends the player's directions
+    """
+    keys = {K_LEFT : DIR_LEFT, K_a : DIR_LEFT,
+            K_RIGHT: DIR_RIGHT, K_d : DIR_RIGHT,
+            K_UP   : DIR_UP, K_w : DIR_UP,
+            K_DOWN : DIR_DOWN, K_s : DIR_DOWN}
+
+    def __init__(self, cfg, res, address):
+        """
+        address "host:port" of the host
+        """
+        host, port = address.rsplit(":", 1)
+        self.connection = Connection(socket.create_connection((host, int(port))))
+        self.view = GameView(cfg, res)
+
+    def update(self, dt):
+        for kind, payload in self.connection.receive():
+            if kind == MSG_STATE:
+                self.view.apply(payload)
+        self.connection.flush()
+        if self.connection.closed:
+            print "client: the host closed the connection"
+            sys.exit()
+        self.view.update(dt)
+
+    def process_event(self, event):
+        if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+            sys.exit()
+        if event.type == KEYDOWN and event.key in self.keys:
+            self.connection.send(MSG_INPUT, struct.pack("<B", self.keys[event.key]))
+
+    def display(self, screen):
+        self.view.display(screen)
+
+    def finish(self):
+        self.connection.close()
@@ -0,0 +1,102 @@
+""" Which moving objects are in which cell
+
+CellOccupancy is updated once per tick with positions of the pacmans or
+of the ghosts. Only objects that changed their cell are moved between
+the buckets. Collisions are then found by looking up a cell instead of
+comparing every pacman with every ghost, and the closest object is
+found by searching the cells around a position.
+"""
+
+from bisect import bisect_left, insort
+
+from utils import *
+
+class CellOccupancy:
+    linear_limit = 8 # with so few objects the nearest one is found by a linear scan
+
+    def __init__(self, grid_cell_size):
+        self.grid_cell_size = grid_cell_size
+        self.buckets = {} # cell -> sorted indices of objects in it
+        self.cells = [] # cell of every object, None if it is not in the maze
+        self.positions = []
+
+    def update(self, positions):
+        """ positions[i] Position of i-th object or None if the object
+                         is not in the maze (i.e. dead pacman)
+        """
+        cells = self.cells
+        for i in range(len(positions), len(cells)): # objects were removed
+            self.__move(i, cells[i], None)
+        del cells[len(positions):]
+        for i, position in enumerate(positions):
+            cell = None
+            if position is not None:
+                cell = position_to_cell(self.grid_cell_size, position)
+            if i == len(cells):
+                cells.append(None)
+            if cells[i] != cell:
+                self.__move(i, cells[i], cell)
+                cells[i] = cell
+        self.positions = list(positions)
+
+    def __move(self, i, old_cell, new_cell):
+        if old_cell is not None:
+            bucket = self.buckets[old_cell]
+            bucket.remove(i)
+            if not bucket:
+                del self.buckets[old_cell]
+        if new_cell is not None:
+            insort(self.buckets.setdefault(new_cell, []), i)
+
+    def in_cell(self, cell, first = 0):
+        """ Indices of objects in the cell
+
+        first Only objects with this or greater index are returned
+        """
+        bucket = self.buckets.get(cell)
+        if not bucket:
+            return []
+        return bucket[bisect_left(bucket, first):]
+
+    def nearest(self, position):
+        """ Index of the object closest to the position (euclidean
+        distance in pixels, the lower index wins a tie) or None if there
+        are no objects in the maze
+        """
+        if len(self.cells) <= self.linear_limit or not self.buckets:
+            return self.__nearest_of(position, range(len(self.cells)))
+        # search rings of cells around the position. An object r cells
+        # away is farther than r-1 cells
+        cx, cy = position_to_cell(self.grid_cell_size, position)
+        step = min(self.grid_cell_size)
+        max_ring = max(max(abs(x - cx), abs(y - cy)) for x, y in self.buckets) # nothing is farther
+        best, best_distance = None, None
+        for r in range(max_ring + 1):
+            bound = max(r - 1, 0) * step
+            if best is not None and best_distance <= bound * bound:
+                break
+            ring = []
+            for x in range(cx - r, cx + r + 1):
+                if abs(x - cx) == r:
+                    ys = range(cy - r, cy + r + 1)
+                else:
+                    ys = (cy - r, cy + r)
+                for y in ys:
+                    ring.extend(self.buckets.get((x, y), ()))
+            i = self.__nearest_of(position, ring)
+            if i is None:
+                continue
+            distance = euclidean_2d_distance_squared(position, self.positions[i])
+            if best is None or (distance, i) < (best_distance, best):
+                best, best_distance = i, distance
+        return best
+
+    def __nearest_of(self, position, indices):
+        best, best_distance = None, None
+        for i in indices:
+            if self.cells[i] is None:
+                continue
+            distance = euclidean_2d_distance_squared(position, self.positions[i])
+            if best is None or (distance, i) < (best_distance, best):
+                best, best_distance = i, distance
+        return best
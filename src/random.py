@@ -11,3 +11,17 @@ class Random:
         self.seed *= 65537
         self.seed %= 3571
         return self.seed % (high - low + 1) + low
+
+class LinearCongruential:
+    """ Better (but still simple and deterministic) generator for
+    things that need many different numbers, i.e. simulated input.
+    Random has a very short period
+    """
+    def __init__(self, seed):
+        self.seed = seed % 2**31
+
+    def integer(self, low, high):
+        """ Return a pseudorandom number from interval [low, high]
+        """
+        self.seed = (self.seed * 1103515245 + 12345) % 2**31
+        return (self.seed >> 16) % (high - low + 1) + low
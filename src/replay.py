@@ -0,0 +1,195 @@
+""" Recording and replaying games
+
+The game is deterministic (see random.py) so it is enough to record
+what the players did and how long every tick took. The log is a header
+followed by one record per tick:
+
+    byte   bit 7 set if dt changed, bits 0-6 number of input changes
+    double new dt (only if bit 7 is set)
+    (byte code, byte value) for every change - code is index of the
+           pacman and value his new direction, or one of INPUT_* codes
+
+Debug keys (killing ghosts, changing phases, skipping levels) are not
+recorded.
+"""
+
+import struct
+from pygame.locals import *
+
+from game_fsm import GameState
+from audio import LOOP_EVENTS
+from const import *
+
+LOG_MAGIC         = "P4TR\x01"
+INPUT_START_GAME  = 0xfe
+INPUT_ADD_PACMAN  = 0xfd
+INPUT_RESTART     = 0xfc
+
+class Recorder:
+    """ Writes inputs of the game to a log file. Call tick right before
+    every update of the game
+    """
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(LOG_MAGIC)
+        self.dt = None
+        self.game_started = False
+        self.directions = []
+        self.games = 0
+
+    def tick(self, game, dt):
+        changes = []
+        if game.games != self.games: # new game of the autopilot
+            changes.append((INPUT_RESTART, 0))
+            self.games = game.games
+            self.game_started = False
+            self.directions = [DIR_STOP] * len(game.pacman)
+        if len(game.pacman) > len(self.directions):
+            for i in range(len(self.directions), len(game.pacman)):
+                if i > 0:
+                    changes.append((INPUT_ADD_PACMAN, 0))
+                self.directions.append(DIR_STOP)
+        for i, pacman in enumerate(game.pacman):
+            if pacman.next_direction != self.directions[i]:
+                self.directions[i] = pacman.next_direction
+                changes.append((i, pacman.next_direction))
+        if game.game_started and not self.game_started:
+            changes.append((INPUT_START_GAME, 0))
+        self.game_started = game.game_started
+
+        header = len(changes)
+        if dt != self.dt:
+            header |= 0x80
+        record = [struct.pack("<B", header)]
+        if dt != self.dt:
+            record.append(struct.pack("<d", dt))
+            self.dt = dt
+        for code, value in changes:
+            record.append(struct.pack("<BB", code, value))
+        self.file.write("".join(record))
+
+    def game_updated(self, game):
+        """ Call it after update of the game. Keeps track of the game
+        being stopped (i.e. when pacman dies)
+        """
+        self.game_started = game.game_started
+
+    def close(self):
+        self.file.close()
+
+def read_log(path):
+    """ Generator of (dt, changes) for every recorded tick
+    """
+    data = open(path, "rb").read()
+    if not data.startswith(LOG_MAGIC):
+        raise ValueError("%s is not a game log" % path)
+    pos = len(LOG_MAGIC)
+    dt = None
+    while pos < len(data):
+        header = ord(data[pos])
+        pos += 1
+        if header & 0x80:
+            dt, = struct.unpack_from("<d", data, pos)
+            pos += 8
+        count = header & 0x7f
+        changes = []
+        for i in range(count):
+            changes.append(struct.unpack_from("<BB", data, pos))
+            pos += 2
+        yield dt, changes
+
+def apply_changes(game, changes):
+    """ Apply recorded inputs to PacmanGame
+    """
+    for code, value in changes:
+        if code == INPUT_START_GAME:
+            game.start_game()
+        elif code == INPUT_ADD_PACMAN:
+            game.add_green_pacman()
+        elif code == INPUT_RESTART:
+            game.restart()
+        else:
+            game.pacman[code].next_direction = value
+
+class RecordingState(GameState):
+    """ Plays the game as usual and records it with Recorder
+    """
+    def __init__(self, game, recorder):
+        self.game = game
+        self.recorder = recorder
+
+    def init(self, screen):
+        self.game.init(screen)
+
+    def update(self, dt):
+        self.game.control() # decisions of controllers are recorded as inputs
+        self.recorder.tick(self.game, dt)
+        self.game.update(dt)
+        self.recorder.game_updated(self.game)
+
+    def process_event(self, event):
+        if event.type == KEYDOWN and event.key == K_ESCAPE:
+            self.recorder.close() # the game exits right away
+        self.game.process_event(event)
+
+    def display(self, screen):
+        self.game.display(screen)
+
+    def interpolate(self, alpha):
+        self.game.interpolate(alpha)
+
+    def background(self):
+        return self.game.background()
+
+    def dirty_rects(self):
+        return self.game.dirty_rects()
+
+    def display_foreground(self, screen):
+        self.game.display_foreground(screen)
+
+    def finish(self):
+        self.recorder.close()
+        self.game.finish()
+
+class ReplayState(RecordingState):
+    """ Feeds recorded inputs to the game instead of the keyboard
+
+    speed How many times faster than recorded the game is replayed
+    """
+    def __init__(self, game, path, speed = 1.0):
+        self.game = game
+        self.ticks = read_log(path)
+        self.speed = speed
+        self.time_budget = 0
+
+    def update(self, dt):
+        self.time_budget += dt * self.speed
+        while self.time_budget > 0:
+            try:
+                recorded_dt, changes = next(self.ticks)
+            except StopIteration:
+                return
+            apply_changes(self.game, changes)
+            self.game.update(recorded_dt)
+            self.time_budget -= recorded_dt
+
+    def process_event(self, event):
+        if event.type in LOOP_EVENTS or event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+            self.game.process_event(event)
+
+    def finish(self):
+        self.game.finish()
+
+def replay_headless(path, cfg = None):
+    """ Replay the log without display as fast as possible
+
+    Returns HeadlessGame in the state from the end of the log
+    """
+    from headless import HeadlessGame
+    headless = HeadlessGame(cfg)
+    for dt, changes in read_log(path):
+        apply_changes(headless.game, changes)
+        headless.game.update(dt)
+        headless.ticks += 1
+        headless.elapsed += dt
+    return headless
@@ -2,13 +2,28 @@
 
 To add new resources to your game put definitions in load_* methods
 
+Sounds are loaded decoded from the PCM cache (see audio.py). If it is
+out of date they are decoded by a pool of threads while the animations
+and fonts are loaded and the cache is written. Sounds that are not
+needed at the start of the game are then decoded lazily - when they
+are played for the first time - and added to the cache. Sounds are
+played by the AudioEngine on the channel pool of their category. Every
+loaded file is timed (see load_report).
+
+In "native" video output (see Config.draw_scale) the animations and
+fonts are scaled once at load time. Then the frames are packed into an
+atlas (see atlas.Atlas).
 """
 
-import os
+import os, time
+from multiprocessing.pool import ThreadPool
 import pygame
 from pygame.locals import *
 
 import color
+from bundle import Bundle, source_stamps, write_bundle
+from atlas import Atlas
+from audio import AudioEngine, read_pcm_cache, write_pcm_cache
 
 class Resources:
     """ Collects all resources in one class
@@ -19,29 +34,125 @@ class Resources:
         self.music     = {}
         self.font      = {}
         self.animation = {}
+        self.bundle    = None
+        self.atlas     = None
+        self.scale     = cfg.draw_scale() # animations and fonts are scaled by it
+        self.sound_category = {} # name -> category of channels it is played on
+        self.audio = AudioEngine(cfg)
+        self.lazy_sounds = set() # decoded when played for the first time
+        self.pcm_stamps = None # sources of sounds in the PCM cache
+        self.pcm_stale = False # sounds were decoded since the cache was written
+        self.load_times = [] # (kind, name, seconds) of every loaded resource
+        self.pool = None
+        self.tasks = []
 
     def load_all(self):
-        if self.cfg.sound:
-            self.load_sound_files()
-        if self.cfg.music:
-            self.load_music_files()
+        if self.cfg.loader_threads > 1:
+            self.pool = ThreadPool(self.cfg.loader_threads)
+        try:
+            start = time.time()
+            if self.cfg.sound:
+                self.audio.open()
+                self.load_sound_files()
+            if self.cfg.music:
+                self.load_music_files()
+            self.__timed("animations", "all", self.load_animations)
+            if self.scale != 1:
+                self.__timed("animations", "scale", self.scale_animations)
+            if self.cfg.sprite_atlas:
+                self.atlas = self.__timed("animations", "atlas", Atlas, self.animation)
+            self.load_font_files()
+            for task in self.tasks:
+                task.get() # waits for the task, raises its errors
+            if self.pcm_stale:
+                self.__timed("sound", "write cache", self.write_sound_cache)
+            self.load_times.append(("total", "load_all", time.time() - start))
+        finally:
+            if self.pool:
+                # join would wait for pool's housekeeping thread, it
+                # finishes in the background
+                self.pool.close()
+                self.pool = None
+                self.tasks = []
+
+    def load_report(self):
+        """ Text with load times of resources - slowest first
+        """
+        lines = ["%-10s %-20s %8.2f ms" % (kind, name, seconds * 1000)
+                 for kind, name, seconds in sorted(self.load_times, key = lambda t: -t[2])]
+        return "\n".join(lines)
+
+    def __timed(self, kind, name, f, *args):
+        start = time.time()
+        result = f(*args)
+        self.load_times.append((kind, name, time.time() - start))
+        return result
+
+    def load_animations(self):
+        """ Load animations from the bundle. If it doesn't exist or is
+        out of date build animations from images and save the bundle
+        """
+        if not self.cfg.asset_bundle:
+            self.load_animation_files()
+            return
+        stamps = source_stamps(self.cfg.gfx_path(""))
+        bundle_path = self.cfg.cache_path("animations.bundle")
+        if os.path.isfile(bundle_path):
+            bundle = Bundle(bundle_path)
+            if bundle.is_fresh(stamps):
+                self.bundle = bundle
+                self.animation = bundle.animations()
+                return
+            bundle.close()
         self.load_animation_files()
-        self.load_font_files()
+        try:
+            write_bundle(bundle_path, self.animation, stamps)
+        except (IOError, OSError), e: # i.e. read only installation
+            print "Can't write asset bundle:", e
+
+    def scale_animations(self):
+        """ Pre-scale frames of all animations by self.scale
+        """
+        s = self.scale
+        for name, animation in self.animation.items():
+            self.animation[name] = [pygame.transform.scale(frame, (frame.get_width() * s, frame.get_height() * s))
+                                    for frame in animation]
 
     ## define resources you want to use
 
     def load_sound_files(self):
-        files = ["die",
-                 "duke_good",
-                 "fruit",
-                 "ghost_eat",
-                 "intermission",
-                 "intro",
-                 "powerup",
-                 "siren",
-                 "waka"]
-        for file in files:
-            self.load_sound_file(file)
+        self.sound_category = {"die"          : "effect",
+                               "duke_good"    : "effect",
+                               "fruit"        : "effect",
+                               "ghost_eat"    : "effect",
+                               "powerup"      : "effect",
+                               "intro"        : "jingle",
+                               "intermission" : "jingle",
+                               "siren"        : "loop",
+                               "waka"         : "loop"}
+        # not needed for the first frame
+        lazy = set(["duke_good",
+                    "fruit",
+                    "intermission"])
+        self.pcm_stamps = source_stamps(self.cfg.sounds_path(""), ".ogg")
+        sounds = self.__timed("sound", "cache", read_pcm_cache,
+                              self.cfg.cache_path("sounds.pcm"), self.pcm_stamps)
+        if sounds is not None and set(self.sound_category) - lazy <= set(sounds):
+            self.sounds = sounds
+            self.lazy_sounds = set(self.sound_category) - set(sounds)
+            return
+        for name in self.sound_category:
+            if name not in lazy:
+                self.load_sound_file(name)
+        self.lazy_sounds = lazy
+        self.pcm_stale = True
+
+    def write_sound_cache(self):
+        try:
+            write_pcm_cache(self.cfg.cache_path("sounds.pcm"), self.sounds, self.pcm_stamps)
+        except (IOError, OSError), e: # i.e. read only installation
+            print "Can't write sound cache:", e
+        self.pcm_stale = False
 
     def load_music_files(self):
         self.load_music_file("one-five-nine")
@@ -50,7 +161,6 @@ class Resources:
         self.load_animation_file("level")
         self.load_animation_file("hud")
         self.load_animation_file("dot")
-        self.load_animation_file("board")
         self.load_animation_file("powerup")
 
         self.load_animation_file("pacman-left")
@@ -119,8 +229,27 @@ class Resources:
     ## use resources
 
     def sounds_play(self, name, loop=0):
+        if self.cfg.sound and name in self.lazy_sounds:
+            self.lazy_sounds.remove(name)
+            self.load_sound_file(name)
+            self.pcm_stale = True
+        channel = None
+        if self.cfg.sound and name in self.sounds:
+            channel = self.audio.play(self.sounds[name], self.sound_category[name], loop)
+        if self.pcm_stale:
+            # after the sound started, so it isn't late
+            self.__timed("sound", "write cache", self.write_sound_cache)
+        return channel
+
+    def sounds_loop(self, name, cooldown = None):
+        """ Keep playing the sound in a loop (see AudioEngine.start_loop)
+        """
         if self.cfg.sound and name in self.sounds:
-            return self.sounds[name].play(loop)
+            self.audio.start_loop(name, self.sounds[name], cooldown)
+
+    def sounds_stop_loop(self, name):
+        if self.cfg.sound:
+            self.audio.stop_loop(name)
 
     def music_play(self, name, repeat=-1):
         if self.cfg.music and name in self.music:
@@ -136,7 +265,18 @@ class Resources:
 
     ## load files
     def load_sound_file(self, name):
+        """ Decodes the sound. During load_all it is done in the
+        background and None is returned
+        """
+        if self.pool:
+            self.tasks.append(self.pool.apply_async(self.load_sound_file_now, (name,)))
+            return None
+        return self.load_sound_file_now(name)
+
+    def load_sound_file_now(self, name):
+        start = time.time()
         sound = self.sounds[name] = pygame.mixer.Sound(self.cfg.sounds_path(name + ".ogg"))
+        self.load_times.append(("sound", name, time.time() - start))
         return sound
 
     def load_music_file(self, name):
@@ -148,7 +288,9 @@ class Resources:
             self.font[name]
         except:
             self.font[name] = {}
-        font = self.font[name][size] = pygame.font.Font(self.cfg.font_path(name + ".ttf"), size)
+        start = time.time()
+        font = self.font[name][size] = pygame.font.Font(self.cfg.font_path(name + ".ttf"), size * self.scale)
+        self.load_times.append(("font", "%s %d" % (name, size), time.time() - start))
         return font
 
     def load_animation_file(self, name):
@@ -0,0 +1,179 @@
+""" Snapshots of the game state
+
+snapshot(game) packs everything the rules of PacmanGame depend on into a
+string with a fixed layout and restore(game, data) puts it back, so the
+game continues exactly as it would from the moment of the snapshot. It
+is used for save states (keys 7 and 8), crash recovery and for branching
+simulations from one state (see headless.py).
+
+Layout (all numbers little endian):
+
+    HEADER   magic, version, uint16 level, uint16 phase number, byte
+             phase, byte FLAG_GAME_* flags, double phase timer, double
+             frightened timer, int64 random seed, int32 dots left,
+             int32 dots eaten, byte count of pacmans, uint16 count of
+             ghosts, byte maze width, byte maze height
+    PACMAN   for every pacman: double x, double y, byte direction, byte
+             next direction, uint32 points, int8 lives
+    GHOST    for every ghost: double x, double y, byte direction, byte
+             next direction, byte state, byte FLAG_GHOST_* flags,
+             double target x, double target y, int16 x, y of previous
+             cell, int16 x, y of current cell
+    cells    width * height bytes of maze cells (see maze.py)
+
+Only the state of the rules is stored. Animations of sprites, sounds and
+rendered layers are not - layers are rendered again after restore. A
+snapshot can be restored into a game with the same number of ghosts,
+the ghost engine doesn't matter.
+"""
+
+import struct
+
+from maze import Maze
+from occupancy import CellOccupancy
+
+MAGIC   = "P4TS"
+VERSION = 1
+
+FLAG_GAME_STARTED  = 0x01
+FLAG_GAME_FRIGHTEN = 0x02
+
+FLAG_GHOST_FRIGHTENED = 0x01
+FLAG_GHOST_DEAD       = 0x02
+
+HEADER = struct.Struct("<4sBHHBBddqiiBHBB")
+PACMAN = struct.Struct("<ddBBIb")
+GHOST  = struct.Struct("<ddBBBBddhhhh")
+
+def snapshot_size(pacmans, ghosts, maze_size):
+    """ Size in bytes of a snapshot (it depends only on the counts)
+    """
+    return HEADER.size + pacmans * PACMAN.size + ghosts * GHOST.size + maze_size[0] * maze_size[1]
+
+def snapshot(game):
+    """ State of PacmanGame packed into a string
+    """
+    flags = 0
+    if game.game_started:
+        flags |= FLAG_GAME_STARTED
+    if game.frighten_mode:
+        flags |= FLAG_GAME_FRIGHTEN
+    maze = game.maze
+    data = [HEADER.pack(MAGIC, VERSION, game.level_num, game.phase_num, game.phase, flags,
+                        game.phase_timer, game.frightened_timer, game.random.seed,
+                        game.dots_left, game.dots_eaten, len(game.pacman), len(game.ghost),
+                        maze.width, maze.height)]
+    for pacman in game.pacman:
+        x, y = pacman.position
+        data.append(PACMAN.pack(x, y, pacman.direction, pacman.next_direction,
+                                pacman.points, pacman.lives))
+    pack = GHOST.pack
+    for (x, y), direction, next_direction, state, frightened, isdead, (tx, ty), prev_cell, curr_cell in ghost_states(game):
+        flags = 0
+        if frightened:
+            flags |= FLAG_GHOST_FRIGHTENED
+        if isdead:
+            flags |= FLAG_GHOST_DEAD
+        data.append(pack(x, y, direction, next_direction, state, flags, tx, ty,
+                         prev_cell[0], prev_cell[1], curr_cell[0], curr_cell[1]))
+    data.append(str(maze.cells))
+    return "".join(data)
+
+def ghost_states(game):
+    """ (position, direction, next direction, state, frightened, isdead,
+    target, previous cell, current cell) of every ghost
+    """
+    batch = game.ghost_batch
+    if batch:
+        # tolist converts numpy numbers to python ones at once
+        return zip(batch.position.tolist(), batch.direction.tolist(),
+                   batch.next_direction.tolist(), batch.state.tolist(),
+                   batch.frightened.tolist(), batch.isdead.tolist(),
+                   batch.target.tolist(), batch.prev_cell.tolist(), batch.curr_cell.tolist())
+    return [(ghost.position, ghost.direction, ghost.next_direction, ghost.state,
+             ghost.frightened, ghost.isdead, ghost.target, ghost.prev_cell, ghost.curr_cell)
+            for ghost in game.ghost]
+
+def restore(game, data):
+    """ Put the game into the state stored by snapshot
+
+    Raises ValueError if data is not a snapshot or it doesn't fit the
+    game
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("not a game snapshot")
+    (magic, version, level_num, phase_num, phase, flags, phase_timer, frightened_timer, seed,
+     dots_left, dots_eaten, pacmans, ghosts, width, height) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a game snapshot (or of other version)")
+    if len(data) != snapshot_size(pacmans, ghosts, (width, height)):
+        raise ValueError("snapshot has wrong size")
+    if ghosts != len(game.ghost):
+        raise ValueError("snapshot has %d ghosts, the game %d" % (ghosts, len(game.ghost)))
+
+    game.level_num = level_num
+    game.phase_num = phase_num
+    game.phase = phase
+    game.game_started = bool(flags & FLAG_GAME_STARTED)
+    game.frighten_mode = bool(flags & FLAG_GAME_FRIGHTEN)
+    game.phase_timer = phase_timer
+    game.frightened_timer = frightened_timer
+    game.random.seed = seed # the generator is shared with the ghosts
+    game.dots_left = dots_left
+    game.dots_eaten = dots_eaten
+
+    pos = HEADER.size
+    while len(game.pacman) < pacmans:
+        game.add_green_pacman()
+    del game.pacman[pacmans:] # in place - ghosts refer to the list
+    for pacman in game.pacman:
+        x, y, pacman.direction, pacman.next_direction, pacman.points, pacman.lives = PACMAN.unpack_from(data, pos)
+        pacman.position = x, y
+        pos += PACMAN.size
+
+    states = []
+    for i in range(ghosts):
+        states.append(GHOST.unpack_from(data, pos))
+        pos += GHOST.size
+    # new maze object - views of the game (i.e. state_stream) see a new level
+    game.maze = Maze((width, height), bytearray(data[pos:pos + width * height]))
+    for pacman in game.pacman:
+        pacman.set_maze(game.maze)
+    if game.ghost_batch:
+        restore_batch(game.ghost_batch, states)
+        game.ghost_batch.set_maze(game.maze, game.maze_index, game.maze_arrays)
+    else:
+        for ghost, state in zip(game.ghost, states):
+            restore_ghost(ghost, state)
+            ghost.set_maze(game.maze, game.maze_index)
+        game.ghost_cells = CellOccupancy(game.cfg.grid_cell_size)
+        game.ghost_cells.update([ghost.position for ghost in game.ghost])
+    game.pacman_cells.update([pacman.position if pacman.is_alive() else None
+                              for pacman in game.pacman])
+
+    game.dot_layer.render(game.maze)
+    game.full_redraw = True
+
+def restore_ghost(ghost, state):
+    (x, y, ghost.direction, ghost.next_direction, ghost.state, flags,
+     tx, ty, px, py, cx, cy) = state
+    ghost.position = x, y
+    ghost.frightened = bool(flags & FLAG_GHOST_FRIGHTENED)
+    ghost.isdead = bool(flags & FLAG_GHOST_DEAD)
+    ghost.target = tx, ty
+    ghost.prev_cell = px, py
+    ghost.curr_cell = cx, cy
+
+def restore_batch(batch, states):
+    if not states:
+        return
+    x, y, direction, next_direction, state, flags, tx, ty, px, py, cx, cy = zip(*states)
+    batch.position[:] = zip(x, y)
+    batch.direction[:] = direction
+    batch.next_direction[:] = next_direction
+    batch.state[:] = state
+    batch.frightened[:] = [f & FLAG_GHOST_FRIGHTENED != 0 for f in flags]
+    batch.isdead[:] = [f & FLAG_GHOST_DEAD != 0 for f in flags]
+    batch.target[:] = zip(tx, ty)
+    batch.prev_cell[:] = zip(px, py)
+    batch.curr_cell[:] = zip(cx, cy)
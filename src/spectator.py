@@ -0,0 +1,160 @@
+""" Spectator stream - matches for broadcasting and archiving
+
+PacmanGame sends a record of every tick (see state_stream.py) to its
+SpectatorStream. The stream appends the records to a file and sends
+them to viewers connected to a TCP port. SpectatorState shows a stream
+with the usual sprites - from a file at the recorded pace (also a file
+that is still being written) or live from the game.
+
+The file is STREAM_MAGIC followed by frames in the format of network.py
+messages: byte MSG_FRAME, uint16 length of the payload, payload. The
+payload is float dt of the tick and the record. Viewers connected to the
+port receive the same frames, starting with a key frame.
+
+    python run_game.py --stream match.p4s --stream-port 5001
+    python run_game.py --watch match.p4s
+    python run_game.py --watch localhost:5001
+"""
+
+import os, sys, socket, struct, time
+from pygame.locals import *
+
+from game_fsm import GameState
+from state_stream import StateEncoder, GameView
+from network import Connection, HEADER, MSG_FRAME, split_messages, listen, accept
+
+STREAM_MAGIC = "P4SS\x01"
+
+FRAME = struct.Struct("<f")
+
+class SpectatorStream:
+    """ Writes records of the game to a file and/or to viewers
+
+    path File the stream is written to (None for no file)
+    port TCP port viewers connect to (None for no viewers)
+    """
+    flush_ticks = 30 # the file is flushed this often for viewers watching it
+
+    def __init__(self, path = None, port = None):
+        self.encoder = StateEncoder()
+        self.file = None
+        if path:
+            self.file = open(path, "wb")
+            self.file.write(STREAM_MAGIC)
+            self.file.flush()
+        self.server = None
+        if port is not None:
+            self.server = listen(port)
+        self.viewers = []
+        self.ticks = 0
+        self.bytes = 0 # written to the file (every viewer gets the same)
+        self.time = 0 # spent encoding and sending
+
+    def tick(self, game, dt):
+        """ Call it after every update of the game
+        """
+        start = time.time()
+        if self.server:
+            for connection, address in accept(self.server):
+                self.viewers.append(connection)
+                self.encoder.keyframe() # the new viewer needs the whole state
+                print "stream: viewer %s:%d connected" % address
+        payload = FRAME.pack(dt) + self.encoder.encode(game)
+        if self.file:
+            self.file.write(HEADER.pack(MSG_FRAME, len(payload)))
+            self.file.write(payload)
+            if self.ticks % self.flush_ticks == 0:
+                self.file.flush()
+        if self.viewers:
+            for viewer in self.viewers:
+                viewer.send(MSG_FRAME, payload)
+            self.viewers = [viewer for viewer in self.viewers if not viewer.closed]
+        self.ticks += 1
+        self.bytes += HEADER.size + len(payload)
+        self.time += time.time() - start
+
+    def report(self):
+        if self.ticks == 0:
+            return
+        print "stream: %d ticks, %.1f kB, %.1f B/tick, %.3f ms/tick" % (
+            self.ticks, self.bytes / 1024.0, float(self.bytes) / self.ticks,
+            self.time * 1000 / self.ticks)
+
+    def close(self):
+        self.report()
+        self.ticks = 0
+        if self.file:
+            self.file.close()
+            self.file = None
+        for viewer in self.viewers:
+            viewer.close()
+        self.viewers = []
+        if self.server:
+            self.server.close()
+            self.server = None
+
+class SpectatorState(GameState):
+    """ Shows a stream written by SpectatorStream
+
+    source Path of a stream file or "host:port" of a game streaming to
+           a port
+    speed  How many times faster than recorded a file is played
+    """
+    def __init__(self, cfg, res, source, speed = 1.0):
+        self.file = None
+        self.connection = None
+        if os.path.exists(source) or ":" not in source:
+            self.file = open(source, "rb")
+            if self.file.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+                raise ValueError("%s is not a spectator stream" % source)
+        else:
+            host, port = source.rsplit(":", 1)
+            self.connection = Connection(socket.create_connection((host, int(port))))
+        self.view = GameView(cfg, res)
+        self.speed = speed
+        self.incoming = ""
+        self.frames = [] # received and not shown yet
+        self.time_budget = 0
+
+    def update(self, dt):
+        if self.connection:
+            messages = self.connection.receive()
+            if self.connection.closed:
+                print "spectator: the game closed the stream"
+                sys.exit()
+        else:
+            # a file being written grows - read what was appended
+            messages, self.incoming = split_messages(self.incoming + self.file.read())
+        self.frames.extend(payload for kind, payload in messages if kind == MSG_FRAME)
+
+        if self.connection: # live - show everything right away
+            for payload in self.frames:
+                self.view.apply(payload[FRAME.size:])
+            self.frames = []
+            self.view.update(dt)
+            return
+        self.time_budget += dt * self.speed
+        shown = 0
+        while self.time_budget > 0 and shown < len(self.frames):
+            payload = self.frames[shown]
+            shown += 1
+            frame_dt, = FRAME.unpack_from(payload, 0)
+            self.view.apply(payload[FRAME.size:])
+            self.view.update(frame_dt)
+            self.time_budget -= frame_dt
+        del self.frames[:shown]
+        if not self.frames:
+            self.time_budget = min(self.time_budget, 0) # don't catch up after waiting for data
+
+    def process_event(self, event):
+        if event.type == QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
+            sys.exit()
+
+    def display(self, screen):
+        self.view.display(screen)
+
+    def finish(self):
+        if self.file:
+            self.file.close()
+        if self.connection:
+            self.connection.close()
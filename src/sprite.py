@@ -2,8 +2,13 @@
 
 Sprites remember everything that is needed to draw them (i.e. frame
 num, last frame change, image name)
+
+Positions are in the game resolution. When the frames are pre-scaled
+(see Resources.scale) the positions are scaled the same way
 """
 
+import pygame
+
 from const import *
 
 class Sprite:
@@ -12,9 +17,29 @@ class Sprite:
         self.res = res
         self.delay = delay
         self.draw_origin = draw_origin
-        self.frames_count = len(self.res.animation[name])
+        self.frames = self.res.animation[name]
+        self.frames_count = len(self.frames)
+        self.images = self.__images()
         self.reset_animation()
 
+    def __images(self):
+        """ (source surface, area, draw offset) of every frame. Frames
+        packed in the atlas are drawn from the atlas surface
+        """
+        images = []
+        atlas = self.res.atlas
+        for index, frame in enumerate(self.frames):
+            if frame is None: # without display (see HeadlessResources)
+                images.append((None, None, (0, 0)))
+                continue
+            w,h = frame.get_size()
+            offset = (-(w/2), -(h/2)) if self.draw_origin == ORIGIN_CENTER else (0, 0)
+            if atlas and self.name in atlas.rects:
+                images.append((atlas.surface, atlas.rects[self.name][index], offset))
+            else:
+                images.append((frame, None, offset))
+        return images
+
     def reset_animation(self):
         self.current_frame_index = 0
         self.next_frame_change_time = self.delay
@@ -29,14 +54,19 @@ class Sprite:
             self.current_frame_index %= self.frames_count
 
     def current_frame(self):
-        return self.res.animation[self.name][self.current_frame_index]
+        return self.frames[self.current_frame_index]
+
+    def rect(self, position):
+        """ Area of the screen covered by display(screen, position)
+        """
+        w,h = self.frames[self.current_frame_index].get_size()
+        s = self.res.scale
+        ox, oy = self.images[self.current_frame_index][2]
+        return pygame.Rect(int(position[0] * s + ox), int(position[1] * s + oy), w, h)
 
     def display(self, screen, position):
-        img = self.current_frame()
-        if self.draw_origin == ORIGIN_TOP_LEFT:
-            screen.blit(img, position)
-        elif self.draw_origin == ORIGIN_CENTER:
-            w,h = img.get_size()
-            x,y = position
-            display_position = (x-w/2, y-h/2)
-            screen.blit(img, display_position)
+        """ screen is a Surface or a RenderQueue
+        """
+        surface, area, (ox, oy) = self.images[self.current_frame_index]
+        s = self.res.scale
+        screen.blit(surface, (position[0] * s + ox, position[1] * s + oy), area)
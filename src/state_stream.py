@@ -0,0 +1,287 @@
+""" Compact binary stream of what is shown on the screen
+
+StateEncoder turns PacmanGame into a record per tick holding only what
+changed since the previous record: moved sprites, eaten dots and the
+HUD values. GameView applies the records and displays the game with the
+usual sprites and layers, without running the game rules.
+
+A record (all numbers little endian):
+
+    byte   flags (RECORD_*)
+    key frame (RECORD_KEYFRAME):
+      byte count of pacmans, byte color of every pacman (index to COLORS)
+      uint16 count of ghosts, byte color of every ghost
+      byte length and name of the animation drawn under the maze
+      byte width, byte height, uint16 size, zlib compressed maze cells
+    HUD (RECORD_HUD):
+      uint16 level, byte phase, byte HUD_* flags, int32 frightened
+      timer and int32 phase timer in tenths of a second
+      uint32 points and byte lives of every pacman
+    uint16 count of moved sprites, (uint16 id, int16 x, int16 y, byte
+           sprite) for every one. Pacmans have ids from 0, ghosts
+           follow them. Positions are in 1/8 pixel, sprite 255 hides
+           the sprite
+    uint16 count of eaten dots, (byte x, byte y) cell of every one
+
+The first record and every record after a change of the level or of
+the number of pacmans or ghosts is a key frame - the complete state.
+Records are framed by the transport (see network.py).
+"""
+
+import struct, zlib
+
+from sprite import Sprite
+from maze import Maze
+from layers import DotLayer, HudLayer, hud_items
+from atlas import RenderQueue
+from utils import *
+from const import *
+
+COLORS = ["yellow", "green", "red", "teal", "pink", "orange"]
+
+RECORD_KEYFRAME = 0x01
+RECORD_HUD      = 0x02
+
+HUD_GAME_STARTED = 0x01
+HUD_FRIGHTEN     = 0x02
+
+SPRITE_HIDDEN = 0xff
+POSITION_SCALE = 8
+
+ENTITY = struct.Struct("<HhhB")
+HUD = struct.Struct("<HBBii")
+PACMAN_HUD = struct.Struct("<IB")
+
+def tenths(seconds):
+    """ The timer as displayed in the HUD ("%.1f") in tenths of a second
+    """
+    return int(round(float("%.1f" % seconds) * 10))
+
+class StateEncoder:
+    def __init__(self):
+        self.keyframe()
+
+    def keyframe(self):
+        """ Make the next record a key frame (i.e. for a new spectator)
+        """
+        self.roster = None
+        self.maze = None
+        self.cells = None
+        self.sprites = {}
+        self.hud = None
+
+    def encode(self, game):
+        """ Record of changes of the game since the previous call
+        """
+        flags = 0
+        record = [""]
+        roster = ([COLORS.index(pacman.color) for pacman in game.pacman],
+                  [COLORS.index(ghost.color) for ghost in game.ghost])
+        if roster != self.roster or game.maze is not self.maze:
+            self.keyframe()
+            self.roster, self.maze = roster, game.maze
+            self.cells = bytearray(game.maze.cells)
+            flags |= RECORD_KEYFRAME
+            pacman_colors, ghost_colors = roster
+            cells = zlib.compress(str(self.cells))
+            record.append(struct.pack("<B", len(pacman_colors)))
+            record.append("".join(chr(c) for c in pacman_colors))
+            record.append(struct.pack("<H", len(ghost_colors)))
+            record.append("".join(chr(c) for c in ghost_colors))
+            record.append(struct.pack("<B", len(game.level.background)) + game.level.background)
+            record.append(struct.pack("<BBH", game.maze.width, game.maze.height, len(cells)))
+            record.append(cells)
+
+        hud_flags = 0
+        if game.game_started:
+            hud_flags |= HUD_GAME_STARTED
+        if game.frighten_mode:
+            hud_flags |= HUD_FRIGHTEN
+        hud = [HUD.pack(game.level_num, game.phase, hud_flags,
+                        tenths(game.frightened_timer), tenths(game.phase_timer))]
+        for pacman in game.pacman:
+            hud.append(PACMAN_HUD.pack(pacman.points, pacman.lives))
+        hud = "".join(hud)
+        if hud != self.hud:
+            self.hud = hud
+            flags |= RECORD_HUD
+            record.append(hud)
+
+        moved = []
+        sprites = self.sprites
+        entities = [(pacman.position, pacman.direction if pacman.is_alive() else SPRITE_HIDDEN)
+                    for pacman in game.pacman]
+        entities.extend((ghost.position, ghost.sprite_id()) for ghost in game.ghost)
+        for i, (position, sprite) in enumerate(entities):
+            state = (int(round(position[0] * POSITION_SCALE)), int(round(position[1] * POSITION_SCALE)), sprite)
+            if sprites.get(i) != state:
+                sprites[i] = state
+                moved.append(ENTITY.pack(i, *state))
+        record.append(struct.pack("<H", len(moved)))
+        record.extend(moved)
+
+        eaten = []
+        cells = game.maze.cells
+        if cells != self.cells:
+            w = game.maze.width
+            for i, (old, new) in enumerate(zip(self.cells, cells)):
+                if old != new:
+                    eaten.append(struct.pack("<BB", i % w, i / w))
+            self.cells = bytearray(cells)
+        record.append(struct.pack("<H", len(eaten)))
+        record.extend(eaten)
+
+        record[0] = struct.pack("<B", flags)
+        return "".join(record)
+
+class PacmanView:
+    def __init__(self, res, color):
+        self.color = color
+        self.position = (0, 0)
+        self.sprite_id = SPRITE_HIDDEN
+        self.points = 0
+        self.lives = 0
+        self.sprite = [Sprite("pacman-left-"+color,  res, 0.03),
+                       Sprite("pacman-down-"+color,  res, 0.03),
+                       Sprite("pacman-right-"+color, res, 0.03),
+                       Sprite("pacman-up-"+color,    res, 0.03),
+                       Sprite("pacman-stop-"+color,  res, 0.03)]
+
+    def is_alive(self):
+        return self.lives > 0
+
+class GhostView:
+    def __init__(self, res, color):
+        self.color = color
+        self.position = (0, 0)
+        self.sprite_id = SPRITE_HIDDEN
+        self.sprite = [Sprite("ghost-left-"+color, res, 0.1),
+                       Sprite("ghost-down-"+color, res, 0.1),
+                       Sprite("ghost-right-"+color, res, 0.1),
+                       Sprite("ghost-up-"+color, res, 0.1),
+                       Sprite("ghost-frightened", res, 0.5),
+                       Sprite("ghost-frightened-blink", res, 0.5),
+                       Sprite("eyes-left", res),
+                       Sprite("eyes-down", res),
+                       Sprite("eyes-right", res),
+                       Sprite("eyes-up", res)]
+
+class GameView:
+    """ The game as described by the records of StateEncoder
+
+    It has the attributes of PacmanGame the HUD is made of (see
+    layers.hud_items)
+    """
+    def __init__(self, cfg, res):
+        self.cfg = cfg
+        self.res = res
+        self.pacman = []
+        self.ghost = []
+        self.maze = None
+        self.level_num = 0
+        self.phase = GAME_PHASE_NONE
+        self.phase_timer = 0
+        self.frighten_mode = False
+        self.frightened_timer = 0
+        self.game_started = False
+        self.has_keyframe = False
+        self.powerup = Sprite("powerup", res, 0.5)
+        self.background = "level"
+        self.dot_layer = DotLayer(cfg, Sprite(self.background, res, None, ORIGIN_TOP_LEFT),
+                                  Sprite("dot", res), self.powerup)
+        self.hud_layer = HudLayer(res, Sprite("hud", res, None, ORIGIN_TOP_LEFT),
+                                  {"yellow" : Sprite("life-yellow", res),
+                                   "green"  : Sprite("life-green", res)})
+        self.render_queue = RenderQueue()
+
+    def apply(self, record):
+        """ Apply a record of StateEncoder. Records before the first key
+        frame are ignored
+        """
+        flags, = struct.unpack_from("<B", record, 0)
+        pos = 1
+        if flags & RECORD_KEYFRAME:
+            pos = self.__apply_keyframe(record, pos)
+        elif not self.has_keyframe:
+            return
+        if flags & RECORD_HUD:
+            self.level_num, self.phase, hud_flags, frightened, phase = HUD.unpack_from(record, pos)
+            pos += HUD.size
+            self.game_started = bool(hud_flags & HUD_GAME_STARTED)
+            self.frighten_mode = bool(hud_flags & HUD_FRIGHTEN)
+            self.frightened_timer = frightened / 10.0
+            self.phase_timer = phase / 10.0
+            for pacman in self.pacman:
+                pacman.points, pacman.lives = PACMAN_HUD.unpack_from(record, pos)
+                pos += PACMAN_HUD.size
+
+        count, = struct.unpack_from("<H", record, pos)
+        pos += 2
+        pacmans = len(self.pacman)
+        for k in range(count):
+            i, x, y, sprite = ENTITY.unpack_from(record, pos)
+            pos += ENTITY.size
+            entity = self.pacman[i] if i < pacmans else self.ghost[i - pacmans]
+            entity.position = float(x) / POSITION_SCALE, float(y) / POSITION_SCALE
+            entity.sprite_id = sprite
+
+        count, = struct.unpack_from("<H", record, pos)
+        pos += 2
+        for k in range(count):
+            cell = struct.unpack_from("<BB", record, pos)
+            pos += 2
+            eaten = self.maze.eat(cell)
+            if eaten:
+                self.dot_layer.eat(cell, eaten)
+
+    def __apply_keyframe(self, record, pos):
+        count, = struct.unpack_from("<B", record, pos)
+        pos += 1
+        colors = [COLORS[ord(c)] for c in record[pos:pos + count]]
+        pos += count
+        if [pacman.color for pacman in self.pacman] != colors:
+            self.pacman = [PacmanView(self.res, color) for color in colors]
+        count, = struct.unpack_from("<H", record, pos)
+        pos += 2
+        colors = [COLORS[ord(c)] for c in record[pos:pos + count]]
+        pos += count
+        if [ghost.color for ghost in self.ghost] != colors:
+            self.ghost = [GhostView(self.res, color) for color in colors]
+        size, = struct.unpack_from("<B", record, pos)
+        background = record[pos + 1:pos + 1 + size]
+        pos += 1 + size
+        if background != self.background:
+            self.background = background
+            self.dot_layer.background = Sprite(background, self.res, None, ORIGIN_TOP_LEFT)
+        w, h, size = struct.unpack_from("<BBH", record, pos)
+        pos += 4
+        self.maze = Maze((w, h), bytearray(zlib.decompress(record[pos:pos + size])))
+        pos += size
+        self.dot_layer.render(self.maze)
+        self.has_keyframe = True
+        return pos
+
+    def update(self, dt):
+        """ Animate the sprites
+        """
+        self.powerup.update(dt)
+        for entity in self.pacman + self.ghost:
+            if entity.sprite_id != SPRITE_HIDDEN:
+                entity.sprite[entity.sprite_id].update(dt)
+
+    def display(self, screen):
+        if not self.has_keyframe:
+            screen.fill((0,0,0))
+            return
+        queue = self.render_queue
+        self.dot_layer.display(queue)
+        self.dot_layer.display_energizers(queue)
+        for entity in self.ghost + self.pacman:
+            if entity.sprite_id != SPRITE_HIDDEN:
+                entity.sprite[entity.sprite_id].display(queue, entity.position)
+        if not self.game_started:
+            text_ready = self.res.font_render("LESSERCO", 16, "READY!", (255,255,0))
+            queue.blit(text_ready, scaled(self.res.scale, (100,125)))
+        self.hud_layer.update(hud_items(self))
+        self.hud_layer.display(queue, (self.cfg.board_size[0], 0))
+        queue.flush(screen)
@@ -0,0 +1,175 @@
+""" Parameter sweeps over headless games
+
+Runs HeadlessGame for every combination of configuration overrides
+and seeds on all cores and writes a CSV table with one row per
+combination of overrides (averaged over seeds):
+
+    python run_sweep.py --set ghost_speed=30,40,50 \\
+                        --set phase_durations_lvl_1=0:7:20:7:20:5:20:5,0:5:25:5:25:5:25:5 \\
+                        --seeds 20 --policy random --output sweep.csv
+
+--set NAME=V1,V2,...  Config attribute and its values (numbers or text).
+                      Lists are written with ':' between elements. May be
+                      repeated
+--seeds N             Seeds 0..N-1 for every combination (default 10).
+                      The seed is used by the input policy and by the
+                      ghosts (Config.random_seed)
+--policy NAME         "random", "scripted" or "autopilot" input (default
+                      random)
+--players N           1 or 2 pacmans (default 1)
+--max-ticks N         Stop games that take longer (default 36000 - ten
+                      minutes of game time)
+--workers N           Number of processes (default: all cores)
+--runs FILE           Also write one row per game to FILE
+--output FILE         Where to write the table (default: stdout)
+"""
+
+import sys, csv, itertools, multiprocessing
+
+from config import Config, argument_value
+from headless import HeadlessGame, HeadlessResources
+from random import LinearCongruential
+from autopilot import AutopilotController
+from const import *
+
+def parse_value(text):
+    """ Number, list of numbers written as 1:2:3 or - if it is not a
+    number - the text itself (i.e. ghost_engine=numpy)
+    """
+    if ":" in text:
+        return [parse_value(element) for element in text.split(":")]
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def format_value(value):
+    if isinstance(value, list):
+        return ":".join(str(element) for element in value)
+    return str(value)
+
+def parse_overrides(argv):
+    """ Returns list of (name, [values]) from --set arguments
+    """
+    overrides = []
+    for i, arg in enumerate(argv[:-1]):
+        if arg == "--set":
+            name, values = argv[i + 1].split("=", 1)
+            overrides.append((name, [parse_value(value) for value in values.split(",")]))
+    return overrides
+
+def scripted_policy(seed, players):
+    """ Every pacman turns every second, each starting in other direction
+    """
+    directions = [DIR_LEFT, DIR_UP, DIR_RIGHT, DIR_DOWN]
+    def policy(game):
+        k = game.ticks / 60 + seed
+        return [directions[(k + i) % 4] for i in range(players)]
+    return policy
+
+def random_policy(seed, players):
+    """ Pacmans turn to random directions at random moments
+    """
+    random = LinearCongruential(seed)
+    def policy(game):
+        inputs = []
+        for i in range(players):
+            if random.integer(0, 29) == 0:
+                inputs.append(random.integer(DIR_LEFT, DIR_UP))
+            else:
+                inputs.append(None)
+        return inputs
+    return policy
+
+def autopilot_policy(seed, players):
+    """ Pacmans are played by AutopilotController (see autopilot.py)
+    """
+    def policy(game):
+        for pacman in game.game.pacman:
+            if pacman.controller is None:
+                pacman.controller = AutopilotController(game.game.level, game.game.distance_tables, game.cfg)
+        return None
+    return policy
+
+policies = {
+    "scripted"  : scripted_policy,
+    "random"    : random_policy,
+    "autopilot" : autopilot_policy,
+    }
+
+resources_cache = {} # loaded once per process
+
+def run_game(job):
+    """ Play one headless game. Returns dictionary of measured values
+    """
+    overrides, seed, policy_name, players, max_ticks = job
+    cfg = Config()
+    for name, value in overrides:
+        if not hasattr(cfg, name):
+            raise ValueError("Config has no attribute %s" % name)
+        setattr(cfg, name, value)
+    cfg.random_seed = seed % 3570 + 1
+    if not "headless" in resources_cache:
+        resources_cache["headless"] = HeadlessResources(cfg)
+        resources_cache["headless"].load_all()
+
+    game = HeadlessGame(cfg, players, res = resources_cache["headless"])
+    lives = sum(pacman.lives for pacman in game.game.pacman)
+    game.run(policies[policy_name](seed, players), max_ticks)
+
+    deaths = lives - sum(pacman.lives for pacman in game.game.pacman)
+    return {"seed"            : seed,
+            "ticks"           : game.ticks,
+            "survival_time"   : game.elapsed,
+            "score"           : sum(pacman.points for pacman in game.game.pacman),
+            "dots_eaten"      : game.game.dots_eaten,
+            "dots_per_second" : game.game.dots_eaten / game.elapsed if game.elapsed else 0,
+            "level"           : game.game.level_num,
+            "deaths"          : deaths,
+            "deaths_per_level": float(deaths) / game.game.level_num}
+
+measures = ["survival_time", "score", "dots_eaten", "dots_per_second", "level", "deaths", "deaths_per_level"]
+
+def main():
+    overrides = parse_overrides(sys.argv)
+    seeds = int(argument_value("--seeds", 10))
+    policy = argument_value("--policy", "random")
+    players = int(argument_value("--players", 1))
+    max_ticks = int(argument_value("--max-ticks", 36000))
+    workers = int(argument_value("--workers", multiprocessing.cpu_count()))
+    output = argument_value("--output")
+    runs_output = argument_value("--runs")
+    if policy not in policies:
+        sys.exit("unknown policy %s, use one of: %s" % (policy, ", ".join(policies)))
+
+    names = [name for name, values in overrides]
+    combinations = list(itertools.product(*[values for name, values in overrides]))
+    jobs = []
+    for combination in combinations:
+        for seed in range(seeds):
+            jobs.append((zip(names, combination), seed, policy, players, max_ticks))
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(run_game, jobs, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+
+    if runs_output:
+        writer = csv.writer(open(runs_output, "wb"))
+        writer.writerow(names + ["seed", "ticks"] + measures)
+        for job, result in zip(jobs, results):
+            writer.writerow([format_value(value) for name, value in job[0]] +
+                            [result["seed"], result["ticks"]] + [result[measure] for measure in measures])
+
+    writer = csv.writer(open(output, "wb") if output else sys.stdout)
+    writer.writerow(names + ["games"] + ["mean_" + measure for measure in measures])
+    for i, combination in enumerate(combinations):
+        games = results[i * seeds:(i + 1) * seeds]
+        means = [sum(game[measure] for game in games) / float(len(games)) for measure in measures]
+        writer.writerow([format_value(value) for value in combination] + [len(games)] + means)
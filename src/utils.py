@@ -11,3 +11,55 @@ def direction_to_vector(direction):
         return (0,-1)
     if direction == DIR_STOP:
         return (0,0)
+
+def cells_euclidean_2d_distance_squared(grid_cell_size, cell0, cell1):
+    pos0 = cell_to_position(grid_cell_size, cell0)
+    pos1 = cell_to_position(grid_cell_size, cell1)
+    return euclidean_2d_distance_squared(pos0, pos1)
+
+def euclidean_2d_distance_squared(pos0, pos1):
+    x0,y0 = pos0
+    x1,y1 = pos1
+    dx = x1 - x0
+    dy = y1 - y0
+    return dx*dx+dy*dy
+
+def position_to_cell(grid_cell_size, position):
+    px, py = position[0] - 2, position[1] - 2
+    cw, ch = grid_cell_size
+    cx, cy = int(px / cw) + 11, int(py / ch) + 11
+    return (cx, cy)
+
+def cell_to_position(grid_cell_size, cell):
+    cx, cy = cell
+    cx -= 11
+    cy -= 11
+    cw, ch = grid_cell_size
+    return (cx * cw + 2, cy * ch + 2)
+
+def current_cell(movable):
+    return position_to_cell(movable.cfg.grid_cell_size, movable.position)
+
+def cell_center(grid_cell_size, cell):
+    cx,cy = cell_to_position(grid_cell_size, cell)
+    cx += grid_cell_size[0] / 2
+    cy += grid_cell_size[1] / 2
+    return (cx, cy)
+
+def scaled(scale, values):
+    """ Position or rect (x, y, w, h) multiplied by the draw scale
+    """
+    return tuple(value * scale for value in values)
+
+def interpolate(previous, position, alpha, max_distance = 16):
+    """ Position shown between two ticks. alpha is how far (0 to 1) it
+    is from the previous position. Jumps (tunnel, reset) are shown
+    right away
+    """
+    if alpha >= 1:
+        return position
+    px, py = previous
+    x, y = position
+    if abs(x - px) > max_distance or abs(y - py) > max_distance:
+        return position
+    return (px + (x - px) * alpha, py + (y - py) * alpha)